@@ -0,0 +1,145 @@
+#!/usr/bin/python3
+# Boot profiler for the ARCHIE Pi (Another Remote Community Hotspot for Instruction and Education).
+# Records how long after power-on the ARCHIE Pi starts serving: the time to the first DHCP
+# lease handed to a client, the time until nginx responds and the time until kiwix responds.
+# Measurements are appended to a file on the SD card so boots can be compared over time.
+#
+# Usage:
+#   boot-profile.py record [--label LABEL]   (run at every boot by archie-boot-profile.service)
+#   boot-profile.py report
+#
+# (C) 2026 faculty and students from Calvin University
+#
+# License: GNU General Public License (GPL) v3
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+import urllib.request
+
+RESULTS_FILE = '/var/lib/archie-pi/boot-times.csv'   # on the SD card so it survives a reboot
+LEASE_FILES = ['/var/log/dnsmasq.leases', '/var/lib/misc/dnsmasq.leases']
+URLS = {'nginx':'http://127.0.0.1/', 'kiwix':'http://127.0.0.1:81/'}
+POLL_INTERVAL = 0.2         # seconds between checks
+
+# Helper functions
+def do(cmd):
+    ''' Execute system command and return result
+    '''
+    result = subprocess.run(cmd.split(), stderr=sys.stderr, stdout=sys.stdout)
+    return (result.returncode == 0)
+
+def root_is_readonly():
+    ''' Return True if the root partition is currently mounted read-only
+    '''
+    with open('/proc/mounts') as file:
+        for line in file:
+            fields = line.split()
+            if fields[1] == '/':
+                return 'ro' in fields[3].split(',')
+    return False
+
+def uptime():
+    ''' Return the number of seconds since the kernel started
+    '''
+    with open('/proc/uptime') as file:
+        return float(file.read().split()[0])
+
+def lease_signature():
+    ''' Return the size and modification time of the dnsmasq lease file (if any)
+    '''
+    for lease_file in LEASE_FILES:
+        try:
+            stat = os.stat(lease_file)
+            return (lease_file, stat.st_size, stat.st_mtime)
+        except OSError:
+            pass
+    return None
+
+def responds(url):
+    ''' Return True if a web server responds with HTTP status 200
+    '''
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status == 200
+    except OSError:
+        return False
+
+def record(args):
+    ''' Measure the boot-to-serving times of this boot and append them to the results file
+    '''
+    with open('/proc/sys/kernel/random/boot_id') as file:
+        boot_id = file.read().strip()
+    # leases from a previous boot may remain, so wait for the lease file to change
+    initial_leases = lease_signature()
+    times = {'dhcp':None, 'nginx':None, 'kiwix':None}
+    while None in times.values() and uptime() < args.timeout:
+        if times['dhcp'] is None:
+            leases = lease_signature()
+            if leases and leases != initial_leases and leases[1] > 0:
+                times['dhcp'] = uptime()
+        for name, url in URLS.items():
+            if times[name] is None and responds(url):
+                times[name] = uptime()
+        time.sleep(POLL_INTERVAL)
+    results = ','.join('' if times[name] is None else f'{times[name]:.1f}' for name in ['dhcp','nginx','kiwix'])
+    print(f'Boot {boot_id} ({args.label}): first DHCP lease, nginx, kiwix ready after {results} seconds')
+
+    # briefly remount the root partition in read-write mode (if needed) to save the results
+    remount = args.remount and root_is_readonly()
+    if remount:
+        do('mount -o remount,rw /')
+    try:
+        os.makedirs(os.path.dirname(RESULTS_FILE), exist_ok=True)
+        with open(RESULTS_FILE, 'a') as file:
+            file.write(f'{boot_id},{args.label},{results}\n')
+            file.flush()
+            os.fsync(file.fileno())
+    finally:
+        if remount:
+            do('mount -o remount,ro /')
+
+def report():
+    ''' Show the recorded boots and the median times for each label (for example, before and
+        after the boot optimisations were applied)
+    '''
+    try:
+        with open(RESULTS_FILE) as file:
+            rows = [line.strip().split(',') for line in file if line.strip()]
+    except OSError:
+        sys.exit('No boots recorded yet.')
+    print(f"{'boot':<38}{'label':<12}{'DHCP lease':>12}{'nginx':>8}{'kiwix':>8}")
+    for row in rows[-20:]:
+        print(f'{row[0]:<38}{row[1]:<12}{row[2]:>12}{row[3]:>8}{row[4]:>8}')
+    print('\nMedian seconds from power-on:')
+    for label in sorted(set(row[1] for row in rows)):
+        medians = []
+        for column in [2, 3, 4]:
+            values = [float(row[column]) for row in rows if row[1] == label and row[column]]
+            medians.append(f'{statistics.median(values):.1f}' if values else '-')
+        boots = len([row for row in rows if row[1] == label])
+        print(f'{label:<12} DHCP lease {medians[0]}, nginx {medians[1]}, kiwix {medians[2]} ({boots} boots)')
+
+parser = argparse.ArgumentParser(description='ARCHIE Pi boot profiler')
+commands = parser.add_subparsers(dest='command', required=True)
+record_parser = commands.add_parser('record', help='measure and record the current boot')
+record_parser.add_argument("--label", dest="label", help="label used to compare boot configurations",
+                           type=str, required=False, default='default')
+record_parser.add_argument("--timeout", dest="timeout", help="seconds after power-on to stop waiting (default 600)",
+                           type=float, required=False, default=600)
+record_parser.add_argument("--remount", dest="remount", help="remount the root partition read-write to save results",
+                           action='store_true')
+commands.add_parser('report', help='show recorded boot times')
+args = parser.parse_args()
+
+if args.command == 'record':
+    record(args)
+else:
+    report()
@@ -0,0 +1,83 @@
+#!/usr/bin/python3
+# Script to build a provisioning bundle for the ARCHIE Pi (Another Remote Community Hotspot
+# for Instruction and Education). The bundle contains a local apt repository, a python wheelhouse
+# and the kiwix tools, so that setup.py can install an ARCHIE Pi without internet access:
+#   sudo ./setup.py --country US --bundle /media/usb/archie-bundle
+#
+# Build the bundle once (with internet access) on a Raspberry Pi running a fresh install of the
+# same Raspberry Pi OS version (and 32-bit or 64-bit variant) as the Pis to be provisioned.
+#
+# (C) 2026 faculty and students from Calvin University
+#
+# License: GNU General Public License (GPL) v3
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import argparse
+import os
+import sys
+import subprocess
+from packages import APT_PACKAGES, PIP_PACKAGES, get_latest_kiwix_tools
+
+# Helper functions
+def do(cmd, cwd=None):
+    ''' Show and execute system command and return result
+    '''
+    print(f'-> {cmd}')
+    result = subprocess.run(cmd.split(), stderr=sys.stderr, stdout=sys.stdout, cwd=cwd)
+    return (result.returncode == 0)
+
+def get_dependencies(packages):
+    ''' Return the given packages and all packages they depend on (recursively). Packages
+        already installed on this Pi are included since they may be older or missing on the
+        Pis to be provisioned.
+    '''
+    cmd = 'apt-cache depends --recurse --no-recommends --no-suggests --no-conflicts --no-breaks --no-replaces --no-enhances ' + packages
+    result = subprocess.run(cmd.split(), stdout=subprocess.PIPE)
+    dependencies = set()
+    for line in result.stdout.decode('utf-8').split('\n'):
+        # dependencies are indented and virtual packages are shown in angle brackets
+        if line and not line[0].isspace() and not line.startswith('<'):
+            dependencies.add(line.strip())
+    return sorted(dependencies)
+
+parser = argparse.ArgumentParser(description='Build an ARCHIE Pi provisioning bundle')
+parser.add_argument("--output", dest="output", help="bundle folder (default archie-bundle)",
+                    type=str, required=False, default='archie-bundle')
+args = parser.parse_args()
+
+bundle = os.path.abspath(args.output)
+debs = f'{bundle}/debs'
+print(f'Building ARCHIE Pi provisioning bundle in {bundle}...')
+os.makedirs(f'{debs}/partial', exist_ok=True)
+os.makedirs(f'{bundle}/wheels', exist_ok=True)
+
+# Tools used to build the bundle
+do('apt-get update') or sys.exit('Error: Unable to update package lists.')
+do('apt-get -y install dpkg-dev lynx python3-pip') or sys.exit('Error: cannot install bundle tools')
+
+# Download OS upgrades and all required packages (with their dependencies) into a local apt repository
+print('Downloading packages...')
+do(f'apt-get -o Dir::Cache::archives={debs} -y --download-only dist-upgrade') or sys.exit('Error: cannot download OS upgrades')
+do('apt-get download ' + ' '.join(get_dependencies(APT_PACKAGES)), cwd=debs) or sys.exit('Error: cannot download packages')
+os.rmdir(f'{debs}/partial')
+if os.path.exists(f'{debs}/lock'):
+    os.remove(f'{debs}/lock')
+with open(f'{debs}/Packages', 'w') as file:
+    subprocess.run(['dpkg-scanpackages', '--multiversion', '.', '/dev/null'], stdout=file, cwd=debs, check=True)
+
+# Build wheels for the python packages
+print('Building python wheels...')
+do(f'pip3 wheel --wheel-dir {bundle}/wheels {PIP_PACKAGES}') or sys.exit('Error: cannot build python wheels')
+
+# Download the latest kiwix tools
+filename = get_latest_kiwix_tools()
+print(f'Downloading {filename}...')
+do(f'wget -nv --show-progress -O {bundle}/kiwix-tools.tgz {filename}') or sys.exit('kiwix download failed')
+
+size = subprocess.check_output(['du','-sh', bundle]).split()[0].decode('utf-8')
+print(f'\nThe provisioning bundle is ready ({size}).')
+print('Copy the bundle folder to a USB drive and provision each ARCHIE Pi using:')
+print(f'sudo ./setup.py --country <country code> --bundle <path to {os.path.basename(bundle)}>')
@@ -0,0 +1,219 @@
+#!/usr/bin/python3
+# Script to build a ready-to-flash ARCHIE Pi (Another Remote Community Hotspot for Instruction
+# and Education) image on a Linux PC, instead of running setup.py and install-modules.py on each Pi.
+# The image is configured by running setup.py (including the read-only hardening) and
+# install-modules.py in a chroot of a Raspberry Pi OS Lite image, using qemu-user emulation:
+#   sudo ./build-image.py 2024-11-19-raspios-bookworm-armhf-lite.img.xz --modules nqt --country US
+#
+# Requires: qemu-user-static (with binfmt-support), parted, e2fsprogs and xz-utils.
+# bmap-tools is optional and used to create a block map for faster flashing.
+#
+# (C) 2026 faculty and students from Calvin University
+#
+# License: GNU General Public License (GPL) v3
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import argparse
+import glob
+import os
+import platform
+import shlex
+import shutil
+import sys
+import subprocess
+
+SOURCE = os.path.dirname(os.path.abspath(__file__))
+TARGET = '/opt/archie-pi'           # location of the ARCHIE Pi scripts in the image
+BUNDLE = '/tmp/archie-bundle'       # location of the provisioning bundle (if any) in the image
+
+# Helper functions
+def do(cmd):
+    ''' Show and execute system command and return result
+    '''
+    print(f'-> {cmd}')
+    result = subprocess.run(cmd.split(), stderr=sys.stderr, stdout=sys.stdout)
+    return (result.returncode == 0)
+
+def do_chroot(root, cmd):
+    ''' Show and execute a command in the image (from the ARCHIE Pi scripts folder) and return result
+    '''
+    print(f'-> (chroot) {cmd}')
+    result = subprocess.run(['chroot', root, '/bin/sh', '-c', f'cd {TARGET} && {cmd}'],
+                            stderr=sys.stderr, stdout=sys.stdout)
+    return (result.returncode == 0)
+
+def check_emulation(root):
+    ''' Make sure programs in the image can run on this machine. On a PC the ARM programs are
+        run by qemu-user, registered with binfmt_misc by the qemu-user-static package. The
+        emulator is copied into the image unless it is registered with the F (fix binary) flag.
+        Returns a list of files copied into the image.
+    '''
+    with open(f'{root}/bin/sh', 'rb') as f:
+        header = f.read(5)
+    arch = 'aarch64' if header[4] == 2 else 'arm'      # 64-bit or 32-bit ELF executable
+    if platform.machine() == arch or (arch == 'arm' and platform.machine() in ['armv7l', 'aarch64']):
+        return []
+    try:
+        with open(f'/proc/sys/fs/binfmt_misc/qemu-{arch}') as f:
+            info = dict(line.split(' ', 1) for line in f.read().split('\n') if ' ' in line)
+    except OSError:
+        sys.exit(f'Error: qemu-{arch} emulation is not available (install qemu-user-static and binfmt-support)')
+    if 'F' in info.get('flags:', ''):
+        return []
+    interpreter = info['interpreter'].strip()
+    shutil.copy(interpreter, f'{root}{interpreter}')
+    return [f'{root}{interpreter}']
+
+def ignore_files(folder, names):
+    ''' Return the files in the ARCHIE Pi scripts folder that are not copied into the image:
+        the git repository, python caches, images and provisioning bundles (a bundle built in
+        the scripts folder is large and is mounted separately when given with --bundle)
+    '''
+    ignored = set(shutil.ignore_patterns('.git', '__pycache__', '*.img*')(folder, names))
+    for name in names:
+        path = os.path.join(folder, name)
+        if (args.bundle and os.path.realpath(path) == os.path.realpath(args.bundle)) or \
+           (os.path.isdir(os.path.join(path, 'debs')) and os.path.isdir(os.path.join(path, 'wheels'))):
+            ignored.add(name)
+    return ignored
+
+parser = argparse.ArgumentParser(description='Build an ARCHIE Pi image')
+parser.add_argument("base", help="Raspberry Pi OS Lite image (.img or .img.xz)", type=str)
+parser.add_argument("--output", dest="output", help="output image (default archie-pi.img, compressed to archie-pi.img.xz)",
+                    type=str, required=False, default='archie-pi.img')
+parser.add_argument("--modules", dest="modules", help="letter(s) of the module(s) to install (see install-modules.py)",
+                    type=str, required=False, default='')
+parser.add_argument("--grow", dest="grow", help="GB added to the image for modules (default 4)",
+                    type=float, required=False, default=4)
+parser.add_argument("--country", dest="country", help="default Wi-Fi country code (can be changed in archie-pi.txt before first boot)",
+                    type=str, required=False)
+parser.add_argument("--ssid", dest="ssid", help="default Wi-Fi acces point station id",
+                    type=str, required=False, default='ARCHIE-Pi')
+parser.add_argument("--user", dest="user", help="user of the image (created if needed, log in using SSH keys from archie-pi.txt)",
+                    type=str, required=False, default='pi')
+parser.add_argument("--bundle", dest="bundle", help="install packages from a provisioning bundle folder (see build-bundle.py)",
+                    type=str, required=False)
+parser.add_argument("--no-compress", dest="compress", help="keep the uncompressed (sparse) image",
+                    action='store_false')
+args = parser.parse_args()
+
+if os.geteuid() != 0:
+    sys.exit('Error: build-image.py must be run as root (use sudo)')
+for tool in ['chroot', 'losetup', 'parted', 'e2fsck', 'resize2fs', 'fstrim', 'xz']:
+    if not shutil.which(tool):
+        sys.exit(f'Error: {tool} is required to build an image')
+
+# Copy the base image, leaving unused space sparse, and grow the root partition for the modules
+image = os.path.abspath(args.output)
+print(f'Creating {image} from {args.base}...')
+if args.base.endswith('.xz'):
+    with open(image, 'wb') as f:
+        subprocess.run(['xz', '-dc', args.base], stdout=f, check=True)
+else:
+    do(f'cp --sparse=always {args.base} {image}') or sys.exit('Error: unable to copy base image')
+do(f'truncate -s +{int(args.grow * 2**30)} {image}') or sys.exit('Error: unable to grow image')
+do(f'parted -s {image} resizepart 2 100%') or sys.exit('Error: unable to grow root partition')
+
+loop = subprocess.run(['losetup', '--find', '--show', '--partscan', image],
+                      stdout=subprocess.PIPE, check=True).stdout.decode('utf-8').strip()
+root = f'/tmp/archie-image-{os.getpid()}'
+mounts = []          # mounted folders (unmounted in reverse order)
+copied = []          # files copied into the image for the build only
+resolv_conf = None   # original contents of /etc/resolv.conf in the image
+success = False
+try:
+    do(f'e2fsck -f -y {loop}p2')
+    do(f'resize2fs {loop}p2') or sys.exit('Error: unable to grow root filesystem')
+
+    # Mount the image partitions and the system folders needed by the programs in the image
+    os.makedirs(root)
+    do(f'mount {loop}p2 {root}') or sys.exit('Error: unable to mount root partition')
+    mounts.append(root)
+    boot = f'{root}/boot/firmware' if os.path.isdir(f'{root}/boot/firmware') else f'{root}/boot'
+    do(f'mount {loop}p1 {boot}') or sys.exit('Error: unable to mount boot partition')
+    mounts.append(boot)
+    for folder in ['/dev', '/dev/pts', '/proc', '/sys']:
+        do(f'mount --bind {folder} {root}{folder}') or sys.exit(f'Error: unable to mount {folder}')
+        mounts.append(f'{root}{folder}')
+    do(f'mount -t tmpfs tmpfs {root}/tmp') or sys.exit('Error: unable to mount /tmp')
+    mounts.append(f'{root}/tmp')
+    if args.bundle:
+        os.makedirs(f'{root}{BUNDLE}', exist_ok=True)
+        do(f'mount --bind -o ro {os.path.abspath(args.bundle)} {root}{BUNDLE}') or sys.exit('Error: unable to mount bundle')
+        mounts.append(f'{root}{BUNDLE}')
+    copied += check_emulation(root)
+
+    # Use the DNS servers of this machine (the hardened image links /etc/resolv.conf to /tmp)
+    # and do not start services while packages are installed
+    if os.path.isfile(f'{root}/etc/resolv.conf') and not os.path.islink(f'{root}/etc/resolv.conf'):
+        with open(f'{root}/etc/resolv.conf') as f:
+            resolv_conf = f.read()
+        shutil.copy('/etc/resolv.conf', f'{root}/etc/resolv.conf')
+    shutil.copy('/etc/resolv.conf', f'{root}/tmp/resolv.conf')
+    with open(f'{root}/usr/sbin/policy-rc.d', 'w') as f:
+        f.write('#!/bin/sh\nexit 101\n')
+    os.chmod(f'{root}/usr/sbin/policy-rc.d', 0o755)
+    copied.append(f'{root}/usr/sbin/policy-rc.d')
+
+    # Copy the ARCHIE Pi scripts (also used at first boot and to install more modules later)
+    shutil.copytree(SOURCE, f'{root}{TARGET}', ignore=ignore_files)
+
+    # Create the user (without a password since SSH keys are used to log in) and skip the
+    # first boot user setup of Raspberry Pi OS
+    with open(f'{root}/etc/passwd') as f:
+        users = [line.split(':')[0] for line in f]
+    if args.user not in users:
+        do_chroot(root, f'useradd -m -s /bin/bash -G sudo,adm {shlex.quote(args.user)}') or sys.exit('Error: unable to create user')
+        with open(f'{root}/etc/sudoers.d/010_{args.user}-nopasswd', 'w') as f:
+            f.write(f'{args.user} ALL=(ALL) NOPASSWD: ALL\n')
+        os.chmod(f'{root}/etc/sudoers.d/010_{args.user}-nopasswd', 0o440)
+    do_chroot(root, 'systemctl disable userconfig')    # not present on all OS versions
+
+    # Apply the ARCHIE Pi setup and install the modules
+    options = f'--image --read-only --user {shlex.quote(args.user)} --ssid {shlex.quote(args.ssid)}'
+    options += f' --country {shlex.quote(args.country)}' if args.country else ''
+    options += f' --bundle {BUNDLE}' if args.bundle else ''
+    do_chroot(root, f'python3 setup.py {options}') or sys.exit('Error: setup failed')
+    if args.modules:
+        do_chroot(root, f'python3 install-modules.py --image --user {shlex.quote(args.user)} --modules {shlex.quote(args.modules)}') or sys.exit('Error: module install failed')
+
+    # Remove the keys and identifiers that must be unique to each Pi (created at first boot)
+    for filename in glob.glob(f'{root}/etc/ssh/ssh_host_*'):
+        os.remove(filename)
+    open(f'{root}/etc/machine-id', 'w').close()
+    success = True
+finally:
+    for filename in copied:
+        if os.path.exists(filename):
+            os.remove(filename)
+    if resolv_conf is not None and os.path.isfile(f'{root}/etc/resolv.conf') and not os.path.islink(f'{root}/etc/resolv.conf'):
+        with open(f'{root}/etc/resolv.conf', 'w') as f:
+            f.write(resolv_conf)
+    if root in mounts:
+        # discard the unused blocks so they remain sparse in the image (and compress well)
+        do(f'fstrim -v {root}')
+        do(f'fstrim -v {boot}')
+    for folder in reversed(mounts):
+        do(f'umount {folder}')
+    if os.path.isdir(root):
+        os.rmdir(root)
+    do(f'losetup -d {loop}')
+if not success:
+    sys.exit('Error: image build failed')
+
+# Create a block map so that only the used blocks are written when flashing with bmaptool
+if shutil.which('bmaptool'):
+    do(f'bmaptool create -o {image}.bmap {image}') or sys.exit('Error: unable to create block map')
+if args.compress:
+    print('Compressing image (this may take a while)...')
+    do(f'xz -f -T0 {image}') or sys.exit('Error: unable to compress image')
+    image += '.xz'
+
+size = subprocess.check_output(['du','-h', image]).split()[0].decode('utf-8')
+print(f'\nThe ARCHIE Pi image is ready: {image} ({size}).')
+print('Flash the image to any number of SD cards at once, for example using:')
+print(f'bmaptool copy {image} /dev/sdX  (or Raspberry Pi Imager, without OS customisation)')
+print('Set the wifi country, SSID and SSH keys in archie-pi.txt on the boot partition of each card before first boot.')
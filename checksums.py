@@ -0,0 +1,30 @@
+# Checksum manifests for the ARCHIE Pi (Another Remote Community Hotspot for Instruction and
+# Education), used by scrub-modules.py to detect corruption of installed modules and by
+# install-modules.py to derive the content hashes of the asset manifests.
+#
+# (C) 2026 faculty and students from Calvin University
+#
+# License: GNU General Public License (GPL) v3
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import hashlib
+
+MANIFEST = '.checksums.json'        # checksum manifest stored in each module folder
+CHUNK_SIZE = 16*2**20               # large files (like ZIMs) are hashed in chunks of this size
+
+def hash_chunks(path):
+    ''' Return the SHA-256 checksums of each chunk of a file
+    '''
+    hashes = []
+    with open(path, 'rb') as file:
+        while True:
+            data = file.read(CHUNK_SIZE)
+            if not data and hashes:
+                break
+            hashes.append(hashlib.sha256(data).hexdigest())
+            if len(data) < CHUNK_SIZE:
+                break
+    return hashes
@@ -0,0 +1,529 @@
+#!/usr/bin/python3
+# Cluster service for the ARCHIE Pi (Another Remote Community Hotspot for Instruction and Education).
+# Several ARCHIE Pis connected by a wired LAN act as one hotspot: each node discovers the others,
+# modules are replicated across the nodes according to the free space each reports, content is
+# synced peer-to-peer between nodes, and the front page links each module to the least-loaded
+# node holding it. Nodes only trust peers that sign their messages with the cluster secret.
+#
+# Usage:
+#   cluster.py serve --address ADDR [--port PORT] [--peers ADDR:PORT,...] ...
+#   cluster.py status
+#   cluster.py pull MODULE [--kiwix DIR]
+#
+# (C) 2026 faculty and students from Calvin University
+#
+# License: GNU General Public License (GPL) v3
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import argparse
+import hmac
+import html
+import json
+import os
+import re
+import shutil
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.parse
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import psutil
+
+MODULES_DIR = '/var/www/modules'
+STATE_FILE = '/tmp/archie-cluster.json'   # tmpfs, read by the front page (www/index.php)
+HTTP_PORT = 8090            # port used for status queries and peer-to-peer content sync
+DISCOVERY_PORT = 8089       # UDP port used to broadcast discovery beacons on the LAN
+POLL_INTERVAL = 10          # seconds between beacons and status polls
+PEER_TIMEOUT = 60           # seconds after which a silent peer is forgotten
+RESERVE = 2**30             # free space (bytes) each node keeps in reserve
+PARTIAL_PREFIX = '.sync-'   # modules are synced into a hidden folder until complete
+INSTALLING = '.installing'  # marker (a pid and the modules being installed) created by install-modules.py
+REMOVED = '.removed'        # modules removed from this node by remove-modules.py (not fetched again)
+SECRET_FILE = '/etc/archie-pi/cluster.key'   # secret shared by the nodes of a cluster
+SIGNATURE_HEADER = 'X-Archie-Cluster'        # request header signed with the cluster secret
+
+# Helper functions
+def do(cmd):
+    ''' Execute system command and return result
+    '''
+    result = subprocess.run(cmd.split(), stderr=sys.stderr, stdout=sys.stdout)
+    return (result.returncode == 0)
+
+def root_is_readonly():
+    ''' Return True if the root partition is currently mounted read-only
+    '''
+    with open('/proc/mounts') as file:
+        for line in file:
+            fields = line.split()
+            if fields[1] == '/':
+                return 'ro' in fields[3].split(',')
+    return False
+
+def get_dir_size(path):
+    ''' Return the total size (in bytes) of the files in a directory
+    '''
+    size = 0
+    for root, dirs, files in os.walk(path):
+        for file in files:
+            try:
+                size += os.lstat(os.path.join(root, file)).st_size
+            except OSError:
+                pass
+    return size
+
+def get_manifest(path):
+    ''' Return a list of [relative path, size, mtime] for each file in a directory
+    '''
+    manifest = []
+    for root, dirs, files in os.walk(path):
+        dirs.sort()
+        for file in sorted(files):
+            filepath = os.path.join(root, file)
+            if os.path.islink(filepath):
+                continue
+            stat = os.stat(filepath)
+            manifest.append([os.path.relpath(filepath, path), stat.st_size, int(stat.st_mtime)])
+    return manifest
+
+def read_secret(secret_file):
+    ''' Return the cluster secret. Students' devices share the network of the cluster (wifi is
+        bridged to the wired LAN), so nodes only trust beacons and requests signed with the secret.
+    '''
+    try:
+        with open(secret_file, 'rb') as file:
+            secret = file.read().strip()
+    except OSError:
+        secret = b''
+    if not secret:
+        sys.exit(f'Error: cluster secret not found in {secret_file}')
+    return secret
+
+def sign(secret, message):
+    ''' Return the signature of a message (string) using the cluster secret
+    '''
+    return hmac.new(secret, message.encode('utf-8'), 'sha256').hexdigest()
+
+def verify(secret, message, signature):
+    ''' Return True if a signature received from a peer matches a message
+    '''
+    return isinstance(signature, str) and hmac.compare_digest(sign(secret, message).encode('utf-8'), signature.encode('utf-8'))
+
+def get_title(path, name):
+    ''' Return the title of a module: the text of the first link in its index.htmlf
+        (or the module name if it has none)
+    '''
+    try:
+        with open(os.path.join(path, 'index.htmlf')) as file:
+            index = re.sub(r'<\?.*?\?>', '', file.read(), flags=re.DOTALL)    # leave out PHP code
+            match = re.search(r'<a[^>]*>(.*?)</a>', index, re.DOTALL)
+    except (OSError, UnicodeDecodeError):
+        match = None
+    title = html.unescape(re.sub(r'<[^>]*>', '', match.group(1))).strip() if match else ''
+    return title or name
+
+def get_zim(path):
+    ''' Return the name used by the kiwix server for a module held as a ZIM file ('' if none)
+    '''
+    for file in sorted(os.listdir(path)):
+        if file.endswith('.zim'):
+            return file[:-len('.zim')]
+    return ''
+
+def get_url(peer, path, secret, timeout=10):
+    ''' Open an http connection to a peer ("address:port") for a given path
+    '''
+    request = urllib.request.Request(f'http://{peer}{urllib.parse.quote(path)}',
+                                     headers={SIGNATURE_HEADER:sign(secret, path)})
+    return urllib.request.urlopen(request, timeout=timeout)
+
+def check_name(name):
+    ''' Return a module name received from a peer, refusing names that are not a single
+        folder name (peers must never write outside of the modules folder)
+    '''
+    if not isinstance(name, str) or not name or name.startswith('.') or os.path.basename(name) != name:
+        raise ValueError(f'invalid module name {name!r}')
+    return name
+
+def check_path(base, path):
+    ''' Return the real path of a file within a folder, refusing absolute paths and paths
+        leading outside of the folder (including through symbolic links)
+    '''
+    if not isinstance(path, str) or os.path.isabs(path):
+        raise ValueError(f'invalid path {path!r}')
+    base = os.path.realpath(base)
+    filepath = os.path.realpath(os.path.join(base, path))
+    if not (filepath + os.sep).startswith(base + os.sep):
+        raise ValueError(f'invalid path {path!r}')
+    return filepath
+
+def check_status(status, peer):
+    ''' Return the status reported by a peer with only the expected fields, raising ValueError
+        if it is not valid. The address of a peer is the one it was contacted at.
+    '''
+    try:
+        modules = {check_name(name):{'size':int(module['size']), 'title':str(module['title']), 'zim':str(module['zim'])}
+                   for name, module in status['modules'].items()}
+        return {'address':peer.rsplit(':', 1)[0], 'port':int(peer.rsplit(':', 1)[1]),
+                'load':int(status['load']), 'loadavg':float(status['loadavg']), 'free':int(status['free']),
+                'modules':modules, 'syncing':[check_name(name) for name in status.get('syncing', [])],
+                'removed':[check_name(name) for name in status.get('removed', [])]}
+    except (KeyError, TypeError, AttributeError):
+        raise ValueError(f'invalid status from {peer}')
+
+def get_load():
+    ''' Return the number of established web connections (nginx and kiwix) and the load average
+    '''
+    connections = 0
+    for conn in psutil.net_connections(kind='tcp'):
+        if conn.status == psutil.CONN_ESTABLISHED and conn.laddr and conn.laddr.port in [80, 81]:
+            connections += 1
+    return connections, os.getloadavg()[0]
+
+def plan_placement(nodes, replicas):
+    ''' Decide which node should hold a copy of each module. Every node computes the same plan
+        from the same view of the cluster, so no coordinator is needed. Largest modules are
+        placed first, each on the nodes with the most free space until the module is held by
+        the requested number of nodes (0 means every node). A node holding a partial copy
+        of a module (from an interrupted sync) is preferred so that it resumes the sync, and
+        a module is never placed on a node it was removed from. Returns a dict mapping each
+        node to the list of modules it should fetch.
+    '''
+    sizes = {}
+    free = {}
+    for id, node in nodes.items():
+        free[id] = node['free'] - RESERVE
+        for name, module in node['modules'].items():
+            sizes[name] = max(sizes.get(name, 0), module['size'])
+    assignments = {id:[] for id in nodes}
+    for name in sorted(sizes, key=lambda name: (-sizes[name], name)):
+        holders = [id for id in nodes if name in nodes[id]['modules']]
+        needed = (replicas or len(nodes)) - len(holders)
+        candidates = sorted([id for id in nodes if id not in holders and name not in nodes[id].get('removed', [])
+                             and free[id] >= sizes[name]],
+                            key=lambda id: (name not in nodes[id].get('syncing', []), -free[id], id))
+        for id in candidates[:max(needed, 0)]:
+            assignments[id].append(name)
+            free[id] -= sizes[name]
+    return assignments
+
+def least_loaded(nodes, name, exclude=None):
+    ''' Return the least-loaded node holding a given module
+    '''
+    holders = [id for id in nodes if name in nodes[id]['modules'] and id != exclude]
+    if not holders:
+        return None
+    return min(holders, key=lambda id: (nodes[id]['load'], nodes[id]['loadavg'], id))
+
+def pull_module(peer, name, modules_dir, secret, kiwix=None, remount=False):
+    ''' Copy a module from a peer, fetching only files that are missing or changed. A new
+        module is synced into a hidden folder and renamed once complete so that a partially
+        synced module is never listed on the front page (and an interrupted sync resumes).
+    '''
+    check_name(name)
+    target = os.path.join(modules_dir, name)
+    if not os.path.isdir(target):
+        target = os.path.join(modules_dir, PARTIAL_PREFIX + name)
+    with get_url(peer, f'/manifest/{name}', secret) as response:
+        manifest = json.load(response)
+    # refuse the whole manifest if any path leads outside of the module folder
+    try:
+        manifest = [(path, int(size), int(mtime)) for path, size, mtime in manifest]
+    except TypeError:
+        raise ValueError(f'invalid manifest for {name}')
+    for path, size, mtime in manifest:
+        if check_path(target, path) == os.path.realpath(target):
+            raise ValueError(f'invalid path {path!r}')
+    # only remount (and restore) the root partition if it is read-only, since the administrator
+    # or another script (such as remove-modules.py) may be writing to it
+    remount = remount and root_is_readonly()
+    if remount:
+        do('mount -o remount,rw /')
+    try:
+        print(f'Syncing {name} from {peer} ({len(manifest)} files)...')
+        for path, size, mtime in manifest:
+            filepath = check_path(target, path)
+            if os.path.isfile(filepath):
+                stat = os.stat(filepath)
+                if stat.st_size == size and int(stat.st_mtime) == mtime:
+                    continue
+            os.makedirs(os.path.dirname(filepath), exist_ok=True)
+            with get_url(peer, f'/file/{name}/{path}', secret, timeout=60) as response:
+                with open(filepath + '.part', 'wb') as file:
+                    shutil.copyfileobj(response, file, 1024*1024)
+            os.replace(filepath + '.part', filepath)
+            os.utime(filepath, (mtime, mtime))
+        if os.path.basename(target) != name:
+            os.rename(target, os.path.join(modules_dir, name))
+        target = os.path.join(modules_dir, name)
+        if kiwix:
+            # add any ZIM files to the kiwix library and restart the kiwix server
+            for path, size, mtime in manifest:
+                if path.endswith('.zim'):
+                    do(f'{kiwix}/kiwix-manage {kiwix}/library_zim.xml add {os.path.join(target, path)}')
+                    do('pkill -SIGHUP kiwix-serve')
+        do(f'chown -R www-data:www-data {target}')
+    finally:
+        if remount:
+            do('mount -o remount,ro /')
+    print(f'Synced {name} from {peer}')
+
+class Node:
+    ''' A cluster node: serves its status and content to peers, discovers and polls peers,
+        and fetches the modules assigned to it by the placement plan.
+    '''
+    def __init__(self, args):
+        self.args = args
+        self.id = f'{args.address}:{args.port}'
+        self.peers = {peer:None for peer in args.peers}   # peer -> last seen (None if static)
+        self.secret = read_secret(args.secret_file)
+        self.nodes = {}           # latest status of every node (including this one)
+        self.sizes = {}           # cached module sizes (computing them is slow for large modules)
+        self.lock = threading.Lock()
+
+    def installing(self):
+        ''' Return the modules being installed by install-modules.py on this node
+            (None if it is not running)
+        '''
+        try:
+            with open(os.path.join(self.args.modules_dir, INSTALLING)) as file:
+                lines = file.read().split('\n')
+            if psutil.pid_exists(int(lines[0])):
+                return [line for line in lines[1:] if line]
+        except (OSError, ValueError):
+            pass
+        return None
+
+    def removed(self):
+        ''' Return the modules removed from this node by remove-modules.py
+        '''
+        try:
+            with open(os.path.join(self.args.modules_dir, REMOVED)) as file:
+                return [line for line in file.read().split('\n') if line]
+        except OSError:
+            return []
+
+    def status(self):
+        ''' Return the status of this node. Modules being installed are not advertised,
+            so peers never copy a partially installed module.
+        '''
+        modules = {}
+        syncing = []
+        installing = self.installing() or []
+        for entry in sorted(os.listdir(self.args.modules_dir)):
+            path = os.path.join(self.args.modules_dir, entry)
+            if entry.startswith(PARTIAL_PREFIX):
+                syncing.append(entry[len(PARTIAL_PREFIX):])
+            if entry.startswith('.') or not os.path.isdir(path):
+                continue
+            if entry in installing:
+                self.sizes.pop(entry, None)
+                continue
+            if entry not in self.sizes:
+                self.sizes[entry] = get_dir_size(path)
+            modules[entry] = {'size':self.sizes[entry], 'title':get_title(path, entry), 'zim':get_zim(path)}
+        connections, loadavg = get_load()
+        return {'address':self.args.address, 'port':self.args.port, 'load':connections, 'loadavg':loadavg,
+                'free':psutil.disk_usage(self.args.modules_dir).free, 'modules':modules, 'syncing':syncing,
+                'removed':self.removed()}
+
+    def beacon(self):
+        ''' Periodically broadcast a discovery beacon on the LAN, signed with the cluster secret
+        '''
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_BROADCAST, 1)
+        beacon = json.dumps({'address':self.args.address, 'port':self.args.port})
+        message = json.dumps({'beacon':beacon, 'signature':sign(self.secret, beacon)}).encode('utf-8')
+        while True:
+            try:
+                sock.sendto(message, ('<broadcast>', self.args.discovery_port))
+            except OSError:
+                pass    # network may not be up yet
+            time.sleep(POLL_INTERVAL)
+
+    def listen(self):
+        ''' Record peers announced by discovery beacons. Only beacons signed with the cluster
+            secret and sent from the address they announce are accepted (a copied beacon
+            sent from another address is ignored).
+        '''
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        sock.bind(('', self.args.discovery_port))
+        while True:
+            data, addr = sock.recvfrom(1024)
+            try:
+                message = json.loads(data)
+                if not verify(self.secret, message['beacon'], message['signature']):
+                    continue
+                beacon = json.loads(message['beacon'])
+                if beacon['address'] != addr[0]:
+                    continue
+                peer = f"{addr[0]}:{int(beacon['port'])}"
+            except (ValueError, KeyError, TypeError, AttributeError):
+                continue
+            if peer != self.id:
+                with self.lock:
+                    if self.peers.get(peer, 0) is not None:
+                        self.peers[peer] = time.time()
+
+    def poll(self):
+        ''' Query the status of every known peer and write the cluster state file
+        '''
+        nodes = {self.id:self.status()}
+        with self.lock:
+            for peer, seen in list(self.peers.items()):
+                if seen is not None and time.time() - seen > PEER_TIMEOUT:
+                    del self.peers[peer]
+            peers = list(self.peers)
+        for peer in peers:
+            try:
+                with get_url(peer, '/status', self.secret) as response:
+                    nodes[peer] = check_status(json.load(response), peer)
+            except (OSError, ValueError):
+                pass    # peer is unreachable, ignore it until it responds again
+        self.nodes = nodes
+        state = {'self':self.id, 'updated':int(time.time()), 'nodes':nodes}
+        with open(self.args.state_file + '.tmp', 'w') as file:
+            json.dump(state, file)
+        os.replace(self.args.state_file + '.tmp', self.args.state_file)
+
+    def sync(self):
+        ''' Fetch the modules assigned to this node, one at a time
+        '''
+        while True:
+            time.sleep(POLL_INTERVAL)
+            nodes = self.nodes
+            if self.installing() is not None:
+                continue
+            for name in plan_placement(nodes, self.args.replicas).get(self.id, []):
+                peer = least_loaded(nodes, name, exclude=self.id)
+                try:
+                    pull_module(peer, name, self.args.modules_dir, self.secret, self.args.kiwix, self.args.remount)
+                except (OSError, ValueError) as e:
+                    print(f'Unable to sync {name} from {peer}: {e}')
+                self.sizes.pop(name, None)
+                # update the status of this node now rather than at the next poll, so that
+                # the module just synced is not assigned (and pulled) again
+                self.nodes = dict(self.nodes, **{self.id:self.status()})
+                break    # re-plan with fresh status after each module
+
+    def serve(self):
+        ''' Start the discovery and sync threads and serve requests from peers
+        '''
+        node = self
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                pass    # avoid filling the small tmpfs log folder
+            def do_GET(self):
+                path = urllib.parse.unquote(self.path)
+                parts = path.strip('/').split('/', 2)
+                # only serve other nodes of the cluster
+                if not verify(node.secret, path, self.headers.get(SIGNATURE_HEADER)):
+                    self.send_error(403)
+                    return
+                try:
+                    if parts == ['status']:
+                        self.send_json(node.status())
+                    elif len(parts) == 2 and parts[0] == 'manifest':
+                        self.send_json(get_manifest(node.module_path(parts[1])))
+                    elif len(parts) == 3 and parts[0] == 'file':
+                        self.send_file(node.module_path(parts[1], parts[2]))
+                    else:
+                        self.send_error(404)
+                except (OSError, ValueError):
+                    self.send_error(404)
+            def send_json(self, data):
+                body = json.dumps(data).encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+            def send_file(self, path):
+                with open(path, 'rb') as file:
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/octet-stream')
+                    self.send_header('Content-Length', str(os.fstat(file.fileno()).st_size))
+                    self.end_headers()
+                    shutil.copyfileobj(file, self.wfile, 1024*1024)
+
+        server = ThreadingHTTPServer(('', self.args.port), Handler)
+        threads = [self.sync]
+        if self.args.discovery:
+            threads += [self.beacon, self.listen]
+        for target in threads:
+            threading.Thread(target=target, daemon=True).start()
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print(f'ARCHIE Pi cluster node {self.id} running...')
+        while True:
+            self.poll()
+            time.sleep(POLL_INTERVAL)
+
+    def module_path(self, name, path=''):
+        ''' Return the path of a module file, refusing paths outside of the module folder
+        '''
+        base = check_path(self.args.modules_dir, check_name(name))
+        return check_path(base, path)
+
+def read_state(state_file):
+    ''' Return the cluster state written by the local cluster service
+    '''
+    try:
+        with open(state_file) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        sys.exit('Error: cluster state not available (is the cluster service running?)')
+
+parser = argparse.ArgumentParser(description='ARCHIE Pi cluster service')
+parser.add_argument("--state-file", dest="state_file", help=f"cluster state file (default {STATE_FILE})",
+                    type=str, required=False, default=STATE_FILE)
+parser.add_argument("--modules-dir", dest="modules_dir", help=f"modules folder (default {MODULES_DIR})",
+                    type=str, required=False, default=MODULES_DIR)
+parser.add_argument("--kiwix", dest="kiwix", help="kiwix folder, used to add synced ZIM files to the kiwix library",
+                    type=str, required=False)
+parser.add_argument("--remount", dest="remount", help="remount the root partition read-write while syncing",
+                    action='store_true')
+parser.add_argument("--secret-file", dest="secret_file", help=f"file holding the cluster secret (default {SECRET_FILE})",
+                    type=str, required=False, default=SECRET_FILE)
+commands = parser.add_subparsers(dest='command', required=True)
+serve_parser = commands.add_parser('serve', help='run the cluster service on this node')
+serve_parser.add_argument("--address", dest="address", help="LAN address of this node",
+                          type=str, required=True)
+serve_parser.add_argument("--port", dest="port", help=f"port for peer requests (default {HTTP_PORT})",
+                          type=int, required=False, default=HTTP_PORT)
+serve_parser.add_argument("--peers", dest="peers", help="comma separated list of additional peers (address:port)",
+                          type=lambda peers: [peer for peer in peers.split(',') if peer], required=False, default=[])
+serve_parser.add_argument("--replicas", dest="replicas", help="number of nodes holding each module (default 2, 0 for all nodes)",
+                          type=int, required=False, default=2)
+serve_parser.add_argument("--discovery-port", dest="discovery_port", help=f"UDP discovery port (default {DISCOVERY_PORT})",
+                          type=int, required=False, default=DISCOVERY_PORT)
+serve_parser.add_argument("--no-discovery", dest="discovery", help="only use the peers given by --peers",
+                          action='store_false')
+commands.add_parser('status', help='show the status of the cluster')
+pull_parser = commands.add_parser('pull', help='copy a module from the least-loaded peer holding it')
+pull_parser.add_argument("module", help="module folder name")
+args = parser.parse_args()
+
+if args.command == 'serve':
+    Node(args).serve()
+elif args.command == 'status':
+    state = read_state(args.state_file)
+    for id, node in sorted(state['nodes'].items()):
+        marker = '*' if id == state['self'] else ' '
+        print(f"{marker}{id}: {node['load']} connections, load {node['loadavg']:.2f}, {node['free']//(2**30)}GB free")
+        for name, module in sorted(node['modules'].items()):
+            print(f"    {name} ({module['size']//(2**20)}MB)")
+elif args.command == 'pull':
+    state = read_state(args.state_file)
+    peer = least_loaded(state['nodes'], args.module, exclude=state['self'])
+    if peer is None:
+        sys.exit(f'{args.module} is not available from any peer')
+    try:
+        pull_module(peer, args.module, args.modules_dir, read_secret(args.secret_file), args.kiwix, args.remount)
+    except (OSError, ValueError) as e:
+        sys.exit(f'Error: unable to sync {args.module} from {peer}: {e}')
@@ -12,12 +12,24 @@
 # MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
 # GNU General Public License for more details.
 
+import argparse
+import atexit
 import sys
 import curses
 from curses import wrapper
 import os
+import hashlib
+import json
 import psutil
 import subprocess
+from checksums import MANIFEST as CHECKSUMS, hash_chunks
+
+# file types listed in the asset manifest of each module (see update_asset_manifest)
+ASSET_EXTENSIONS = ('.html', '.htm', '.css', '.js', '.png', '.jpg', '.jpeg', '.gif', '.svg', '.ico',
+                    '.woff', '.woff2', '.ttf', '.json')
+
+# marker (containing the pid and the modules being installed) checked by the scrubber and cluster service
+INSTALLING = '/var/www/modules/.installing'
 
 # Helper functions
 def do(cmd):
@@ -53,6 +65,46 @@ def get_latest_kiwix_filename(filename_prefix, url):
     matching_filenames.sort()
     return matching_filenames[-1]  # return the most recent file
 
+def update_asset_manifest(module_dir):
+    ''' Create or update the asset manifest of a module. The manifest lists a content hash for
+        each page and asset of the module, with a version that is only bumped when the module
+        has actually changed, so that caches can tell when a module needs to be fetched again.
+        The content hashes are derived from the checksum manifest of the module, so the
+        module is not read again (files missing from the checksum manifest are hashed).
+    '''
+    try:
+        with open(os.path.join(module_dir, CHECKSUMS)) as f:
+            checksums = {path:hashes for path, size, hashes in json.load(f)}
+    except (OSError, ValueError):
+        checksums = {}
+    files = {}
+    for root, dirs, filenames in os.walk(module_dir):
+        for filename in filenames:
+            if filename.startswith('.') or not filename.lower().endswith(ASSET_EXTENSIONS):
+                continue
+            filepath = os.path.join(root, filename)
+            path = os.path.relpath(filepath, module_dir)
+            hashes = checksums.get(path) or hash_chunks(filepath)
+            files[path] = hashlib.sha256(''.join(hashes).encode('utf-8')).hexdigest()[:16]
+    digest = hashlib.sha256(json.dumps(files, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+    manifest_file = os.path.join(module_dir, '.assets.json')
+    try:
+        with open(manifest_file) as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        manifest = {'version':0, 'hash':''}
+    if manifest['hash'] == digest:
+        return False
+    with open(manifest_file, 'w') as f:
+        json.dump({'version':manifest['version']+1, 'hash':digest, 'files':files}, f)
+    return True
+
+def remove_installing_marker():
+    ''' Remove the marker of modules being installed (also called on exit, even after an error)
+    '''
+    if os.path.exists(INSTALLING):
+        os.remove(INSTALLING)
+
 
 def main(screen):
     ''' module installer main function
@@ -69,15 +121,30 @@ def main(screen):
                 'A':'PhET Simulations (English) (66MB)', 'B':'PhET Simulations (Spanish) (69MB)', 'C':'PhET Simulations (French) (68MB)',
                 'S':'Science Made Easy videos (1.7GB)' }
 
+    # module folder names (in /var/www/modules) for each of the available modules
+    MODULE_DIRS = { 'a':'en-algebra2go', 'b':'en-blockly-games', 'c':'en-ck12', 'd':'en-boundless-static', 'e':'en-mustardseedbooks',
+                    'f':'en-ebooks', 'g':'en-worldmap-10', 'h':'en-openstax', 'i':'en-rpi_guide',
+                    'j':'en-scratch', 'k':'en-kaos', 'l':'es-kaos',
+                    'm':'en-wikipedia_for_schools-static', 'n':'en-wikipedia', 'o':'es-wikipedia', 'p':'fr-wikipedia',
+                    'q':'en-wiktionary', 'r':'es-wiktionary', 's':'fr-wiktionary',
+                    't':'en-vikidia', 'u':'es-vikidia', 'v':'fr-vikidia', 'w':'en-kuyers-cer',
+                    'x':'en-wikivoyage', 'y':'es-wikivoyage', 'z':'fr-wikivoyage',
+                    'A':'en-phet', 'B':'es-phet', 'C':'fr-phet',
+                    'S':'en-science-made-easy' }
+
     # root URL for Kiwix resources
     KIWIX_URL = 'http://download.kiwix.org/zim/'
 
     # Set home folder location (username may be different than the default pi)
-    HOME = f'/home/{os.getlogin()}'
+    HOME = f'/home/{args.user or os.getlogin()}'
 
-    selections = ''
+    # Modules may be given on the command line instead of selected from the menu
+    selections = args.modules or ''
+    for c in selections:
+        if c not in OPTIONS.keys():
+            sys.exit(f'Unrecognized module: {c}')
     try:
-        while True:
+        while screen is not None:
             row = 1
             column = 5
             for key in OPTIONS.keys():
@@ -109,7 +176,8 @@ def main(screen):
     except KeyboardInterrupt:                # quit gracefully if ctrl-c is pressed
         sys.exit(0)
 
-    curses.endwin()
+    if screen is not None:
+        curses.endwin()
     if selections == '':
         print('No modules selected... Done')
         sys.exit(0)
@@ -121,14 +189,34 @@ def main(screen):
             print(OPTIONS[letter], end=', ')
     print('\b\b...\n')
 
-    # Temporarily mount root partion in read-write mode for adding content
-    do('mount -o remount,rw /')
+    if not args.image:
+        # Temporarily mount root partion in read-write mode for adding content
+        do('mount -o remount,rw /')
+
+        # Update current date and time
+        do('ntpdate 0.pool.ntp.org')
 
-    # Update current date and time
-    do('ntpdate 0.pool.ntp.org')
+    # Mark the modules being installed so that the scrubber does not check them against
+    # their old checksums and other cluster nodes do not copy partially installed modules
+    module_dirs = [MODULE_DIRS[selection] for selection in selections]
+    remove_installing_marker()
+    append_file(INSTALLING, '\n'.join([str(os.getpid())] + module_dirs)) or sys.exit('Error: unable to mark modules being installed')
+    atexit.register(remove_installing_marker)
+
+    # Modules installed again are no longer recorded as removed (see remove-modules.py)
+    removed_file = '/var/www/modules/.removed'
+    if os.path.exists(removed_file):
+        with open(removed_file) as f:
+            removed = [line for line in f.read().split('\n') if line and line not in module_dirs]
+        with open(removed_file, 'w') as f:
+            f.write(''.join(line + '\n' for line in removed))
 
     # Install the selected modules from various open education resources
     for selection in selections:
+        # In cluster mode, copy the module from another node when available instead of the internet
+        if args.cluster and do(f'python3 cluster.py --kiwix {HOME}/kiwix pull {MODULE_DIRS[selection]}'):
+            print('Done')
+            continue
         if selection == 'm':     # Wikipedia for schools (static version does not require kiwix)
             print('Installing Wikipedia for schools...')
             do('rsync -Paz --info=progress2 --info=name0 rsync://dev.worldpossible.org/rachelmods/en-wikipedia_for_schools-static /var/www/modules') or sys.exit('Error installing content')
@@ -334,21 +422,49 @@ def main(screen):
             do('mv science-made-easy /var/www/modules/en-science-made-easy') or sys.exit('Error moving content')
         print('Done')
 
+    # Create checksum manifests used to detect corruption of the installed modules
+    print('Creating module checksum manifests (this may take a while)...')
+    do('python3 scrub-modules.py build ' + ' '.join(module_dirs))
+
+    # Update asset manifests (from the checksum manifests) so student devices only refresh
+    # their cached copies of changed modules
+    for selection in selections:
+        module_dir = f'/var/www/modules/{MODULE_DIRS[selection]}'
+        if os.path.isdir(module_dir) and update_asset_manifest(module_dir):
+            print(f'Updated asset manifest for {MODULE_DIRS[selection]}')
+
+    remove_installing_marker()
+
     # update ownership and permissions of modules
     print('Setting module folder permissions and ownerships (this may take a while)...')
     do('chown -R www-data.www-data /var/www/modules') or sys.exit('Error changing ownership of modules folder to www-data')
     do('chmod -R 755 /var/www/modules') or sys.exit('Error changing permissions of module files')
 
-    # restart kiwix server
-    do('pkill -SIGHUP kiwix-serve')   # restart kiwix server
+    if not args.image:
+        # restart kiwix server
+        do('pkill -SIGHUP kiwix-serve')   # restart kiwix server
 
-    # Once content is installed and configured, return root partition to read-only mode
-    do('mount -o remount,ro /')
+        # Once content is installed and configured, return root partition to read-only mode
+        do('mount -o remount,ro /')
 
     print(f"\nDONE! ({(psutil.disk_usage('/').free)//(2**30)}GB free).")
     print('** Each content module is subject to its own license terms and conditions.')
     print('** Note that a reboot is recommended.')
     print("** To reboot, type 'sudo reboot' at the command-line.")
 
-# Use wrapper function to ensure original state of terminal is restored on exit
-wrapper(main)
+parser = argparse.ArgumentParser()
+parser.add_argument("--cluster", dest="cluster", help="copy modules from other ARCHIE Pi cluster nodes when available",
+                    action='store_true')
+parser.add_argument("--modules", dest="modules", help="letter(s) of the module(s) to install without showing the menu",
+                    type=str, required=False)
+parser.add_argument("--user", dest="user", help="user whose home folder holds the kiwix tools (default: the login user)",
+                    type=str, required=False)
+parser.add_argument("--image", dest="image", help="install into an image being built by build-image.py (no remounts or restarts)",
+                    action='store_true')
+args = parser.parse_args()
+
+if args.modules:
+    main(None)
+else:
+    # Use wrapper function to ensure original state of terminal is restored on exit
+    wrapper(main)
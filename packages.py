@@ -0,0 +1,33 @@
+# Software packages required by the ARCHIE Pi (Another Remote Community Hotspot for Instruction
+# and Education), used by setup.py to install them and by build-bundle.py to download them into
+# a provisioning bundle.
+#
+# (C) 2026 faculty and students from Calvin University
+#
+# License: GNU General Public License (GPL) v3
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import subprocess
+
+APT_PACKAGES = 'lynx python3-pip ntpdate hostapd dnsmasq dhcpcd nginx php php-fpm php-cli php-sqlite3'
+PIP_PACKAGES = 'psutil pycountry xmltodict'
+KIWIX_TOOLS_PREFIX = 'kiwix-tools_linux-armhf'
+KIWIX_TOOLS_URL = 'https://download.kiwix.org/release/kiwix-tools/'
+
+def get_latest_kiwix_tools(filename_prefix=KIWIX_TOOLS_PREFIX, url=KIWIX_TOOLS_URL):
+    ''' The kiwix tools package is constantly being updated to more recent versions so
+        this function determines the url for the most recent kiwix tools. Since files are normally
+        listed by increasing date, the last matching file is assumed to be the latest.
+    '''
+    cmd = f'lynx -dump -listonly -nonumbers {url}'
+    result = subprocess.run(cmd.split(), stdout=subprocess.PIPE)
+    files = result.stdout.decode('utf-8')
+    files_list = files.split('\n')
+    matching_filenames = []   # list of matching filenames
+    for file in files_list:
+        if filename_prefix in file:
+            matching_filenames.append(file)
+    return matching_filenames[-1]  # the last matching file listed should be the most recent
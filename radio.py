@@ -0,0 +1,184 @@
+# Wifi radio profile selection for the ARCHIE Pi (Another Remote Community Hotspot for Instruction
+# and Education), used by setup.py and set-country.py. Detects the capabilities of the wifi adapter,
+# surveys neighbouring access points and selects the fastest hostapd settings permitted in the
+# current regulatory domain.
+#
+# (C) 2026 faculty and students from Calvin University
+#
+# License: GNU General Public License (GPL) v3
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import os
+import re
+import subprocess
+import sys
+import time
+
+# hostapd settings written by select_radio_profile (replaced when the country changes)
+RADIO_KEYS = ['hw_mode', 'channel', 'ieee80211n', 'wmm_enabled', 'ht_capab', 'ieee80211ac',
+              'vht_capab', 'vht_oper_chwidth', 'vht_oper_centr_freq_seg0_idx', 'country_code']
+BAND_FILE = '/etc/archie-pi/wifi-band'    # band requested at setup (used when the country changes)
+
+# Helper functions
+def do(cmd):
+    ''' Show and execute system command and return result
+    '''
+    print(f'-> {cmd}')
+    result = subprocess.run(cmd.split(), stderr=sys.stderr, stdout=sys.stdout)
+    return (result.returncode == 0)
+
+def get_wifi_capabilities():
+    ''' Parse the output of "iw list" to determine which channels the wifi adapter may use
+        as an access point (given the current regulatory domain) and which channel widths
+        it supports. Channels flagged as disabled, no-IR or requiring radar detection (DFS)
+        are not usable since the builtin Raspberry Pi adapter cannot perform radar detection.
+    '''
+    result = subprocess.run(['iw','list'], stdout=subprocess.PIPE)
+    info = result.stdout.decode('utf-8')
+    capabilities = { 'channels':[], 'ht40':False, 'vht':False, 'vht80':False,
+                     'sgi20':False, 'sgi40':False, 'sgi80':False }
+    for line in info.split('\n'):
+        match = re.search(r'\* (\d+)(\.\d+)? MHz \[(\d+)\]', line)
+        if match:
+            flags = line[match.end():]
+            if 'disabled' not in flags and 'no IR' not in flags and 'radar detection' not in flags:
+                capabilities['channels'].append(int(match.group(3)))
+        elif 'HT20/HT40' in line:
+            capabilities['ht40'] = True
+        elif 'RX HT20 SGI' in line:
+            capabilities['sgi20'] = True
+        elif 'RX HT40 SGI' in line:
+            capabilities['sgi40'] = True
+        elif 'VHT Capabilities' in line:
+            capabilities['vht'] = True
+        elif 'short GI (80 MHz)' in line:
+            capabilities['sgi80'] = True
+        elif 'VHT RX MCS set' in line:
+            # 80MHz support is mandatory for any VHT (802.11ac) capable adapter
+            capabilities['vht80'] = capabilities['vht']
+    return capabilities
+
+def survey_channels(interface='wlan0', attempts=3):
+    ''' Scan for neighbouring access points and return a congestion score for each channel.
+        Each access point adds a weight between 0 and 1 depending on its signal strength
+        (a strong neighbour interferes more than a distant one).
+    '''
+    do(f'ip link set {interface} up')
+    for attempt in range(attempts):
+        result = subprocess.run(['iw','dev',interface,'scan'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        if result.returncode == 0:
+            break
+        time.sleep(2)    # the adapter may be busy, so wait and try again
+    else:
+        print('Unable to survey wifi channels, assuming no neighbouring access points.')
+        return {}
+    scores = {}
+    freq = None
+    for line in result.stdout.decode('utf-8').split('\n'):
+        line = line.strip()
+        if line.startswith('freq:'):
+            freq = int(float(line.split()[1]))
+        elif line.startswith('signal:') and freq is not None:
+            signal = float(line.split()[1])
+            if freq == 2484:
+                channel = 14
+            elif freq < 5000:
+                channel = (freq - 2407)//5
+            else:
+                channel = (freq - 5000)//5
+            scores[channel] = scores.get(channel, 0) + min(max(signal+100, 0), 100)/100
+            freq = None
+    return scores
+
+def congestion(channels, scores):
+    ''' Return the congestion score for a group of channels. In the 2.4GHz band channels
+        overlap, so neighbours up to 4 channels away are included.
+    '''
+    total = 0
+    for channel, score in scores.items():
+        for used in channels:
+            if (used <= 14 and channel <= 14 and abs(channel - used) < 5) or channel == used:
+                total += score
+                break
+    return total
+
+def select_radio_profile(capabilities, scores, band='auto'):
+    ''' Select the highest-throughput hostapd settings supported by the wifi adapter and
+        permitted by the regulatory domain, using the least congested channel. Returns
+        the hostapd settings and a short description of the selected profile.
+    '''
+    usable = capabilities['channels']
+    candidates = []    # list of (channel group, width) tuples in order of preference
+    if band in ['auto','5']:
+        if capabilities['vht80']:
+            for group in [[36,40,44,48], [149,153,157,161]]:
+                if all(channel in usable for channel in group):
+                    candidates.append((group, 80))
+        if not candidates and capabilities['ht40']:
+            for group in [[36,40], [44,48], [149,153], [157,161]]:
+                if all(channel in usable for channel in group):
+                    candidates.append((group, 40))
+        if not candidates:
+            candidates = [([channel], 20) for channel in usable if channel > 14]
+        if not candidates and band == '5':
+            print('Warning: 5GHz is not supported by this adapter in this country, using 2.4GHz instead.')
+    if not candidates:
+        # use only the non-overlapping channels in the 2.4GHz band
+        candidates = [([channel], 20) for channel in [1,6,11] if channel in usable]
+    if not candidates:
+        candidates = [([4], 20)]   # fall back to the original default channel
+
+    group, width = min(candidates, key=lambda candidate: congestion(candidate[0], scores))
+    channel = group[0]
+    settings = f'channel={channel}\nieee80211n=1\nwmm_enabled=1\n'
+    ht_capab = '[HT40+]' if width >= 40 else ''
+    ht_capab += '[SHORT-GI-20]' if capabilities['sgi20'] else ''
+    ht_capab += '[SHORT-GI-40]' if width >= 40 and capabilities['sgi40'] else ''
+    if ht_capab:
+        settings += f'ht_capab={ht_capab}\n'
+    if channel <= 14:
+        settings = 'hw_mode=g\n' + settings
+        return settings, f'2.4GHz channel {channel} ({width}MHz)'
+    settings = 'hw_mode=a\n' + settings
+    if capabilities['vht']:
+        settings += 'ieee80211ac=1\n'
+        if width == 80:
+            if capabilities['sgi80']:
+                settings += 'vht_capab=[SHORT-GI-80]\n'
+            settings += f'vht_oper_chwidth=1\nvht_oper_centr_freq_seg0_idx={channel+6}\n'
+        else:
+            settings += 'vht_oper_chwidth=0\n'
+    return settings, f'5GHz channel {channel} ({width}MHz)'
+
+def save_band(band):
+    ''' Save the band requested at setup (--band or band= in archie-pi.txt), so that the
+        radio profile can be selected again for the same band when the country changes
+    '''
+    os.makedirs(os.path.dirname(BAND_FILE), exist_ok=True)
+    with open(BAND_FILE, 'w') as file:
+        file.write(band + '\n')
+
+def read_band():
+    ''' Return the band requested at setup, or None if it was not saved
+    '''
+    try:
+        with open(BAND_FILE) as file:
+            return file.read().strip() or None
+    except OSError:
+        return None
+
+def update_hostapd_conf(conf_file, radio_settings, country):
+    ''' Replace the radio profile and country code in an existing hostapd configuration file,
+        keeping all other settings (such as the SSID and bridge)
+    '''
+    with open(conf_file) as file:
+        lines = [line for line in file.read().split('\n') if line and line.split('=')[0] not in RADIO_KEYS]
+    position = next((index+1 for index, line in enumerate(lines) if line.startswith('driver=')), 0)
+    lines[position:position] = radio_settings.rstrip('\n').split('\n')
+    lines.append(f'country_code={country}')
+    with open(conf_file + '.tmp', 'w') as file:
+        file.write('\n'.join(lines) + '\n')
+    os.replace(conf_file + '.tmp', conf_file)
@@ -109,6 +109,10 @@ while True:
         print(f'Removing /var/www/modules/{module_dir}...')
         do(f'rm -rf /var/www/modules/{module_dir}') or sys.exit('Error moving content')
 
+    # Record the removal so that ARCHIE Pi cluster nodes do not copy the module back (see cluster.py)
+    with open('/var/www/modules/.removed', 'a') as file:
+        file.write(module_dir + '\n')
+
     reply = input('Done.\nDo you want to remove another module? (y/n) ')
     if reply not in 'yY':
         break
@@ -0,0 +1,331 @@
+#!/usr/bin/python3
+# Content integrity scrubber for the ARCHIE Pi (Another Remote Community Hotspot for Instruction
+# and Education). Detects silent corruption (bit-rot) of installed modules on the SD card.
+#
+# A checksum manifest is kept in each module folder. Each scrub run verifies the next slice of
+# files within a limited I/O budget and read rate, and remembers where it stopped so the next
+# run (even after a power cycle) resumes from that point. Corrupted files are reported and,
+# when a copy of the module is available (for example on a USB drive), repaired.
+#
+# Usage:
+#   scrub-modules.py build [MODULE...]     create checksum manifests for installed modules
+#   scrub-modules.py scrub [--source DIR]  verify (and repair) the next slice of files
+#   scrub-modules.py report                list corrupted modules and files
+#
+# (C) 2026 faculty and students from Calvin University
+#
+# License: GNU General Public License (GPL) v3
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import argparse
+import glob
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+import psutil
+from checksums import MANIFEST, CHUNK_SIZE, hash_chunks
+
+MODULES_DIR = '/var/www/modules'
+ASSET_MANIFEST = '.assets.json'     # updated by install-modules.py after the checksum manifest (not checked)
+STATE_FILE = '/var/lib/archie-pi/scrub.json'   # on the SD card so it survives a power cycle
+CHECKPOINT_INTERVAL = 600           # seconds between saves of the scrub position
+USB_SOURCES = '/media/*/modules'    # module copies on USB drives are used for repairs
+INSTALLING = '.installing'          # marker (a pid and the modules being installed) created by install-modules.py
+
+# Helper functions
+def do(cmd):
+    ''' Execute system command and return result
+    '''
+    result = subprocess.run(cmd.split(), stderr=sys.stderr, stdout=sys.stdout)
+    return (result.returncode == 0)
+
+def root_is_readonly():
+    ''' Return True if the root partition is currently mounted read-only
+    '''
+    with open('/proc/mounts') as file:
+        for line in file:
+            fields = line.split()
+            if fields[1] == '/':
+                return 'ro' in fields[3].split(',')
+    return False
+
+class WritableRoot:
+    ''' Context manager that temporarily remounts the root partition in read-write mode
+        (if it is read-only and remounting is enabled) and restores read-only mode afterwards.
+    '''
+    def __init__(self, remount):
+        self.remount = remount and root_is_readonly()
+    def __enter__(self):
+        if self.remount:
+            do('mount -o remount,rw /')
+    def __exit__(self, *exc):
+        if self.remount:
+            os.sync()
+            do('mount -o remount,ro /')
+
+class Limiter:
+    ''' Limit the read rate (bytes per second) and the total bytes read in a run
+    '''
+    def __init__(self, rate, budget):
+        self.rate = rate
+        self.budget = budget
+        self.total = 0
+        self.start = time.monotonic()
+    def consume(self, count):
+        self.total += count
+        delay = self.total/self.rate - (time.monotonic() - self.start)
+        if delay > 0:
+            time.sleep(delay)
+    def exhausted(self):
+        return self.total >= self.budget
+
+def installing(modules_dir):
+    ''' Return the modules being installed while install-modules.py is running, or None
+        if it is not running (a marker left by an interrupted install is ignored)
+    '''
+    try:
+        with open(os.path.join(modules_dir, INSTALLING)) as file:
+            lines = file.read().split('\n')
+        if psutil.pid_exists(int(lines[0])):
+            return [line for line in lines[1:] if line]
+    except (OSError, ValueError):
+        pass
+    return None
+
+def read_manifest(module_dir):
+    ''' Return the checksum manifest of a module (or None if it has no manifest)
+    '''
+    try:
+        with open(os.path.join(module_dir, MANIFEST)) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return None
+
+def build_manifest(module_dir):
+    ''' Compute and save the checksum manifest of a module: a list of
+        [relative path, size, list of chunk checksums] for each file.
+    '''
+    manifest = []
+    for root, dirs, files in os.walk(module_dir):
+        dirs.sort()
+        for file in sorted(files):
+            filepath = os.path.join(root, file)
+            path = os.path.relpath(filepath, module_dir)
+            if path in [MANIFEST, ASSET_MANIFEST] or os.path.islink(filepath):
+                continue
+            manifest.append([path, os.path.getsize(filepath), hash_chunks(filepath)])
+    with open(os.path.join(module_dir, MANIFEST + '.tmp'), 'w') as file:
+        json.dump(manifest, file)
+    os.replace(os.path.join(module_dir, MANIFEST + '.tmp'), os.path.join(module_dir, MANIFEST))
+    return manifest
+
+def read_state(state_file):
+    ''' Return the saved scrub position and results
+    '''
+    try:
+        with open(state_file) as file:
+            return json.load(file)
+    except (OSError, ValueError):
+        return {'module':'', 'file':0, 'chunk':0, 'corrupt':{}}
+
+def save_state(state, state_file, remount):
+    ''' Save the scrub position and results (atomically, so a power failure during the
+        save leaves either the old or the new state)
+    '''
+    with WritableRoot(remount):
+        os.makedirs(os.path.dirname(os.path.abspath(state_file)), exist_ok=True)
+        with open(state_file + '.tmp', 'w') as file:
+            json.dump(state, file)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(state_file + '.tmp', state_file)
+
+def verify_file(module_dir, entry, limiter, start=0):
+    ''' Verify a file against its manifest entry starting at a given chunk. Returns a tuple
+        (ok, next chunk), where the next chunk is None once the whole file has been verified.
+    '''
+    path, size, hashes = entry
+    filepath = os.path.join(module_dir, path)
+    try:
+        if os.path.getsize(filepath) != size:
+            return False, None
+        with open(filepath, 'rb') as file:
+            file.seek(start*CHUNK_SIZE)
+            for index in range(start, len(hashes)):
+                if limiter.exhausted():
+                    return True, index    # out of budget, resume from this chunk next time
+                data = file.read(CHUNK_SIZE)
+                # drop the pages just read so scrubbing does not evict content cached for students
+                os.posix_fadvise(file.fileno(), index*CHUNK_SIZE, len(data), os.POSIX_FADV_DONTNEED)
+                limiter.consume(len(data))
+                if hashlib.sha256(data).hexdigest() != hashes[index]:
+                    return False, None
+    except OSError:
+        return False, None
+    return True, None
+
+def repair_file(module, entry, sources, modules_dir):
+    ''' Replace a corrupted file with a good copy (verified against the manifest)
+        from one of the repair sources. Returns True if the file was repaired.
+    '''
+    path, size, hashes = entry
+    for source in sources:
+        filepath = os.path.join(source, module, path)
+        if not os.path.isfile(filepath) or os.path.getsize(filepath) != size:
+            continue
+        if hash_chunks(filepath) != hashes:
+            continue
+        target = os.path.join(modules_dir, module, path)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copyfile(filepath, target + '.tmp')
+        os.replace(target + '.tmp', target)
+        shutil.chown(target, 'www-data', 'www-data')
+        return True
+    return False
+
+def scrub(args):
+    ''' Verify the next slice of files, continuing from the saved position
+    '''
+    if installing(args.modules_dir) is not None:
+        print('Modules are being installed, skipping scrub.')
+        return
+    # Run with idle CPU and I/O priority so scrubbing never competes with students
+    os.nice(19)
+    psutil.Process().ionice(psutil.IOPRIO_CLASS_IDLE)
+
+    state = read_state(args.state_file)
+    limiter = Limiter(args.rate*2**20, args.budget*2**30)
+    modules = sorted(entry for entry in os.listdir(args.modules_dir)
+                     if not entry.startswith('.') and os.path.isdir(os.path.join(args.modules_dir, entry)))
+    # forget results for modules that have since been removed
+    state['corrupt'] = {module:files for module, files in state['corrupt'].items() if module in modules}
+    sources = args.sources + glob.glob(USB_SOURCES)
+    if not modules:
+        print('No modules installed.')
+        return
+
+    # resume at the saved position (or the next module if the saved module was removed)
+    position = 0
+    while position < len(modules) and modules[position] < state['module']:
+        position += 1
+    if position == len(modules) or modules[position] != state['module']:
+        state['file'], state['chunk'] = 0, 0
+    checkpoint = time.monotonic()
+    checked = 0
+    for count in range(len(modules)):
+        # stop if install-modules.py has started since, as it may be rewriting the files
+        if installing(args.modules_dir) is not None:
+            break
+        module = modules[(position + count) % len(modules)]
+        if count > 0:
+            state['file'], state['chunk'] = 0, 0
+        state['module'] = module
+        module_dir = os.path.join(args.modules_dir, module)
+        manifest = read_manifest(module_dir)
+        if manifest is None:
+            print(f'{module}: no checksum manifest (run "scrub-modules.py build {module}")')
+            continue
+        while state['file'] < len(manifest) and not limiter.exhausted():
+            entry = manifest[state['file']]
+            ok, state['chunk'] = verify_file(module_dir, entry, limiter, state['chunk'])
+            if state['chunk'] is not None:
+                break     # out of budget in the middle of a large file
+            state['chunk'] = 0
+            corrupt = state['corrupt'].setdefault(module, [])
+            if ok and entry[0] in corrupt:
+                corrupt.remove(entry[0])
+            elif not ok:
+                print(f'{module}: {entry[0]} is corrupted')
+                if entry[0] not in corrupt:
+                    corrupt.append(entry[0])
+            if not corrupt:
+                del state['corrupt'][module]
+            state['file'] += 1
+            checked += 1
+            # save the position regularly in case power is lost during the run
+            if time.monotonic() - checkpoint > CHECKPOINT_INTERVAL:
+                save_state(state, args.state_file, args.remount)
+                checkpoint = time.monotonic()
+                if installing(args.modules_dir) is not None:
+                    break
+        if limiter.exhausted():
+            break
+
+    # files being rewritten by install-modules.py may appear corrupted, so forget the results
+    # for the modules it is installing (they are verified again later) and do not repair
+    modules_installing = installing(args.modules_dir)
+    if modules_installing is not None:
+        for module in modules_installing:
+            state['corrupt'].pop(module, None)
+        save_state(state, args.state_file, args.remount)
+        print(f'Modules are being installed, stopping scrub (resuming next time at {state["module"]}).')
+        return
+
+    # repair corrupted files from a depot or USB copy of the modules (if available)
+    if state['corrupt'] and sources:
+        with WritableRoot(args.remount):
+            for module, files in list(state['corrupt'].items()):
+                manifest = {entry[0]:entry for entry in read_manifest(os.path.join(args.modules_dir, module)) or []}
+                for path in list(files):
+                    if path in manifest and repair_file(module, manifest[path], sources, args.modules_dir):
+                        print(f'{module}: repaired {path}')
+                        files.remove(path)
+                if not files:
+                    del state['corrupt'][module]
+    save_state(state, args.state_file, args.remount)
+    print(f'Verified {checked} files ({limiter.total//2**20}MB), resuming next time at {state["module"]}.')
+    report(state)
+
+def report(state):
+    ''' Print the corrupted modules and files
+    '''
+    if not state['corrupt']:
+        print('No corrupted modules found.')
+    for module, files in sorted(state['corrupt'].items()):
+        print(f'Corrupted module {module}: {len(files)} damaged file(s)')
+        for path in files:
+            print(f'    {path}')
+
+parser = argparse.ArgumentParser(description='ARCHIE Pi content integrity scrubber')
+parser.add_argument("--modules-dir", dest="modules_dir", help=f"modules folder (default {MODULES_DIR})",
+                    type=str, required=False, default=MODULES_DIR)
+parser.add_argument("--state-file", dest="state_file", help=f"scrub position and results (default {STATE_FILE})",
+                    type=str, required=False, default=STATE_FILE)
+parser.add_argument("--remount", dest="remount", help="remount the root partition read-write when saving",
+                    action='store_true')
+commands = parser.add_subparsers(dest='command', required=True)
+build_parser = commands.add_parser('build', help='create checksum manifests for modules without one')
+build_parser.add_argument("modules", help="modules to (re)build (default: all modules without a manifest)",
+                          nargs='*')
+scrub_parser = commands.add_parser('scrub', help='verify the next slice of files')
+scrub_parser.add_argument("--budget", dest="budget", help="maximum GB read in this run (default 4)",
+                          type=float, required=False, default=4)
+scrub_parser.add_argument("--rate", dest="rate", help="maximum read rate in MB/s (default 8)",
+                          type=float, required=False, default=8)
+scrub_parser.add_argument("--source", dest="sources", help="folder with good copies of the modules for repairs (may be repeated)",
+                          type=str, required=False, action='append', default=[])
+commands.add_parser('report', help='list corrupted modules and files')
+args = parser.parse_args()
+
+if args.command == 'build':
+    modules = args.modules or [entry for entry in sorted(os.listdir(args.modules_dir)) if not entry.startswith('.')
+                               and os.path.isdir(os.path.join(args.modules_dir, entry))
+                               and read_manifest(os.path.join(args.modules_dir, entry)) is None]
+    with WritableRoot(args.remount):
+        for module in modules:
+            if not os.path.isdir(os.path.join(args.modules_dir, module)):
+                print(f'{module} is not installed')
+                continue
+            print(f'Building checksum manifest for {module}...')
+            build_manifest(os.path.join(args.modules_dir, module))
+elif args.command == 'scrub':
+    scrub(args)
+elif args.command == 'report':
+    report(read_state(args.state_file))
@@ -15,6 +15,10 @@ import pycountry
 import sys
 import fileinput
 import subprocess
+import time
+from radio import get_wifi_capabilities, survey_channels, select_radio_profile, update_hostapd_conf, read_band
+
+HOSTAPD_CONF = '/etc/hostapd/hostapd.conf'
 
 # Helper functions
 def do(cmd):
@@ -53,6 +57,22 @@ do('mount -o remount,rw /')
 replace_line('country=', f'country={code}', '/etc/wpa_supplicant/wpa_supplicant.conf') or sys.exit('Error changing country code')
 replace_line('REGDOMAIN=', f'REGDOMAIN={code}', '/etc/default/crda') or sys.exit('Error changing regulatory domain setting')
 
+# The usable channels and widths depend on the country, so select the radio profile again
+# for the band requested at setup (so a Pi that fell back to 2.4GHz may now use 5GHz)
+print('Detecting wifi capabilities and surveying channels...')
+do('systemctl stop hostapd')     # the survey cannot scan while the access point is running
+do(f'iw reg set {code}') or sys.exit('Error: regulatory domain update failed')
+time.sleep(1)    # allow the regulatory domain change to take effect
+band = read_band()
+if band is None:
+    # set up before the requested band was saved, so keep the 2.4GHz band if it is in use
+    with open(HOSTAPD_CONF) as file:
+        band = '2.4' if 'hw_mode=g' in file.read().split('\n') else 'auto'
+radio_settings, profile = select_radio_profile(get_wifi_capabilities(), survey_channels(), band)
+update_hostapd_conf(HOSTAPD_CONF, radio_settings, code)
+print(f'Selected wifi profile: {profile}')
+do('systemctl start hostapd')
+
 # Once country is configured, return root partion to read-only mode
 do('mount -o remount,ro /')
 
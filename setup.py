@@ -15,6 +15,13 @@ import os
 import sys
 import subprocess
 import fileinput
+import time
+from radio import get_wifi_capabilities, survey_channels, select_radio_profile, save_band
+from packages import APT_PACKAGES, PIP_PACKAGES, get_latest_kiwix_tools
+
+# Settings applied at the first boot of a Pi flashed with an image made by build-image.py
+FIRST_BOOT_CONFIG = ['/boot/firmware/archie-pi.txt', '/boot/archie-pi.txt']
+FIRST_BOOT_DONE = '/var/lib/archie-pi/first-boot-done'
 
 # Helper functions
 
@@ -25,6 +32,25 @@ def do(cmd):
     result = subprocess.run(cmd.split(), stderr=sys.stderr, stdout=sys.stdout)
     return (result.returncode == 0)
 
+def do_live(cmd):
+    ''' Show and execute a system command that needs the running Pi (such as starting a service).
+        The command is skipped when configuring an image in a chroot (see build-image.py).
+    '''
+    if args.image:
+        print(f'-> {cmd} (skipped for image)')
+        return True
+    return do(cmd)
+
+def root_is_readonly():
+    ''' Return True if the root partition is currently mounted read-only
+    '''
+    with open('/proc/mounts') as file:
+        for line in file:
+            fields = line.split()
+            if fields[1] == '/':
+                return 'ro' in fields[3].split(',')
+    return False
+
 def append_file(file, line):
     ''' Append a line to a given file
     '''
@@ -49,6 +75,19 @@ def replace_line(orig_line, new_line, infile):
             print(line, end='')
     return found
 
+def prepend_file(file, line):
+    ''' Insert a line at the beginning of a given file
+    '''
+    try:
+        with open(file) as f:
+            contents = f.read()
+        with open(file, 'w') as f:
+            f.write(line + '\n' + contents)
+    except:
+        print(f'unable to prepend line to file {file}')
+        return False
+    return True
+
 def uncomment_line(matching_text, infile):
     ''' Uncomment a line with matching text in a specified file
     '''
@@ -75,20 +114,84 @@ def uncomment_line_after(matching_text, infile):
         lastline = line
     return found
 
-def get_latest_kiwix_tools(filename_prefix, url):
-    ''' The kiwix tools package is constantly being updated to more recent versions so
-        this function determines the url for the most recent kiwix tools. Since files are normally
-        listed by increasing date, the last matching file is assumed to be the latest.
+def setup_wifi(country, ssid, band):
+    ''' Set the wifi country and write the hostapd configuration using the fastest radio profile
+        supported by the wifi adapter. This needs the wifi hardware, so for an image it is done
+        at the first boot of each Pi.
+    '''
+    # Add the country code to wpa_supplicant.conf in case it is needed
+    append_file('/etc/wpa_supplicant/wpa_supplicant.conf',f'country={country}') or sys.exit('Error: adding wpa country code')
+
+    # update regulatory domain configuration file
+    # replace_line('REGDOMAIN=',f'REGDOMAIN={country}','/etc/default/crda') or sys.exit('Error: crda country update failed')
+    do(f'iw reg set {country}') or sys.exit('Error: crda country update failed')
+
+    # Disable Bluetooth and enable wifi
+    # NOTE: wifi should only be enabled when country code is set properly (which it should be here)
+    do('rfkill block bluetooth') or sys.exit('Error: bluetooth disable failed')
+    do('rfkill unblock wifi') or sys.exit('Error: wifi enable failed')
+
+    # Select the fastest radio profile supported by the hardware and permitted in this country,
+    # using the least congested channel found by a survey of neighbouring access points
+    print('Detecting wifi capabilities and surveying channels...')
+    time.sleep(1)    # allow the regulatory domain change to take effect
+    capabilities = get_wifi_capabilities()
+    scores = survey_channels()
+    radio_settings, profile = select_radio_profile(capabilities, scores, band)
+    print(f'Selected wifi profile: {profile}')
+    save_band(band)
+
+    # adjust settings in hostapd config file
+    settings=f'interface=wlan0\ndriver=nl80211\n{radio_settings}auth_algs=1\nssid={ssid}\nieee80211d=1\ncountry_code={country}\n'
+    append_file('/etc/hostapd/hostapd.conf', settings) or sys.exit('Error: hostapd.conf append failed')
+
+def first_boot():
+    ''' Apply the settings of a Pi flashed with an image made by build-image.py: the wifi country,
+        SSID and radio profile, unique SSH host keys and (optionally) SSH keys to log in.
+        The settings are read from archie-pi.txt on the boot partition, which can be
+        edited on any computer after flashing.
     '''
-    cmd = f'lynx -dump -listonly -nonumbers {url}'
-    result = subprocess.run(cmd.split(), stdout=subprocess.PIPE)
-    files = result.stdout.decode('utf-8')
-    files_list = files.split('\n')
-    matching_filenames = []   # list of matching filenames
-    for file in files_list:
-        if filename_prefix in file:
-            matching_filenames.append(file)
-    return matching_filenames[-1]  # the last matching file listed should be the most recent
+    config = {'country':'', 'ssid':'ARCHIE-Pi', 'band':'auto', 'ssh_key':[]}
+    for filename in FIRST_BOOT_CONFIG:
+        if os.path.exists(filename):
+            with open(filename) as file:
+                for line in file:
+                    line = line.strip()
+                    if line.startswith('#') or '=' not in line:
+                        continue
+                    key, value = [text.strip() for text in line.split('=', 1)]
+                    if key == 'ssh_key':
+                        config['ssh_key'].append(value)
+                    elif key in config:
+                        config[key] = value
+            break
+    if not config['country']:
+        sys.exit('Error: set the wifi country in archie-pi.txt on the boot partition and reboot')
+
+    # briefly remount the root partition in read-write mode (if needed) to save the settings
+    remount = root_is_readonly()
+    if remount:
+        do('mount -o remount,rw /')
+    setup_wifi(config['country'], config['ssid'], config['band'])
+
+    # The image has no SSH host keys or machine id, so that each Pi gets its own
+    do('ssh-keygen -A') or sys.exit('Error: unable to create SSH host keys')
+    do('systemd-machine-id-setup --commit')
+    if config['ssh_key']:
+        ssh_dir = f'{HOME}/.ssh'
+        os.makedirs(ssh_dir, mode=0o700, exist_ok=True)
+        for key in config['ssh_key']:
+            append_file(f'{ssh_dir}/authorized_keys', key) or sys.exit('Error: unable to add SSH key')
+        do(f'chown -R {user}: {ssh_dir}') or sys.exit('Error: unable to change ownership of SSH keys')
+        do('systemctl enable ssh') or sys.exit('Error: unable to enable ssh')
+        do('systemctl start --no-block ssh')    # ssh is ordered after this service, so do not wait for it
+
+    os.makedirs(os.path.dirname(FIRST_BOOT_DONE), exist_ok=True)
+    append_file(FIRST_BOOT_DONE, config['country']) or sys.exit('Error: unable to save first boot state')
+    if remount:
+        do('sync')
+        do('mount -o remount,ro /')
+    print(f"First boot settings applied (wifi {config['ssid']}, country {config['country']}).")
 
 # Begin setup program
 print('Welcome to the ARCHIE Pi setup.')
@@ -98,86 +201,109 @@ print('Note that this setup program requires a fresh install of the Raspberry Pi
 # Step 0: read comand line parameters and set home folder
 ##########################################################
 parser = argparse.ArgumentParser()
-parser.add_argument("--country", dest="country", help="Wi-Fi country code",
-                    type=str, required=True)
+parser.add_argument("--country", dest="country", help="Wi-Fi country code (for an image, the default country set at first boot)",
+                    type=str, required=False)
 parser.add_argument("--ssid", dest="ssid", help="Wi-Fi acces point station id",
                     type=str, required=False, default='ARCHIE-Pi')
+parser.add_argument("--band", dest="band", help="Wi-Fi band (default: auto selects the fastest supported band)",
+                    type=str, required=False, default='auto', choices=['auto','2.4','5'])
+parser.add_argument("--cluster-node", dest="cluster_node", help="enable cluster mode using this node number (1-254)",
+                    type=int, required=False, choices=range(1,255), metavar='{1..254}')
+parser.add_argument("--cluster-secret", dest="cluster_secret", help="secret shared by all nodes of the cluster (required for cluster mode)",
+                    type=str, required=False)
+parser.add_argument("--no-fast-boot", dest="fast_boot", help="keep the default startup order (used to compare boot times)",
+                    action='store_false')
+parser.add_argument("--bundle", dest="bundle", help="install packages from a provisioning bundle folder (see build-bundle.py) instead of the internet",
+                    type=str, required=False)
+parser.add_argument("--read-only", dest="read_only", help="mount the SD card read-only to avoid corruption on power failure",
+                    action='store_true')
+parser.add_argument("--user", dest="user", help="user whose home folder holds the kiwix tools (default: the login user)",
+                    type=str, required=False)
+parser.add_argument("--image", dest="image", help="configure a Raspberry Pi OS image in a chroot (used by build-image.py)",
+                    action='store_true')
+parser.add_argument("--first-boot", dest="first_boot", help="apply the settings in archie-pi.txt at the first boot of an image",
+                    action='store_true')
 args = parser.parse_args()
+if not args.country and not args.image and not args.first_boot:
+    parser.error('the following arguments are required: --country')
+if args.cluster_node and not args.cluster_secret:
+    parser.error('cluster mode requires --cluster-secret (the same secret on every node)')
+if args.image and args.cluster_node:
+    parser.error('cluster mode needs a node number for each Pi, so it cannot be used for an image')
 
 # Set home folder location (username may be different than the default pi)
-HOME = f'/home/{os.getlogin()}'
+user = args.user or os.getlogin()
+HOME = f'/home/{user}'
 print(f'Home folder set to: {HOME}')
 
+if args.first_boot:
+    first_boot()
+    sys.exit(0)
+
 #########################################################
 # Step 1: Update and upgrade OS and install dependencies
 #########################################################
 print('Staring ARCHIE Pi setup...')
-do('service console-setup restart')
-do('apt update -y') or sys.exit('Error: Unable to update Raspberry Pi OS.')
-do('apt dist-upgrade -y') or sys.exit('Error: Unable to dist-upgrade Raspberry Pi OS.')
-do('apt -y install lynx') or sys.exit('Error: cannot install lynx dependency')
-do('apt -y install python3-pip') or sys.exit('Error: cannot install pip3 dependency')
-do('pip3 install psutil pycountry xmltodict --break-system-packages') or sys.exit('Error: cannot install pip3 dependencies')
-
-# Set current data and time
-do('apt -y install ntpdate') or sys.exit('Error: cannot install ntpdate')
-do('ntpdate 0.pool.ntp.org')
+do_live('service console-setup restart')
+if args.bundle:
+    # Use the local apt repository in the provisioning bundle as the only package source (no network needed).
+    # Its package lists are kept in /tmp so the package lists of the OS sources are not replaced.
+    args.bundle = os.path.abspath(args.bundle)
+    append_file('/tmp/archie-bundle.list', f'deb [trusted=yes] file:{args.bundle}/debs ./') or sys.exit('Error: unable to create bundle source list')
+    os.makedirs('/tmp/archie-bundle-lists/partial', exist_ok=True)
+    apt = ('apt-get -o Dir::Etc::SourceList=/tmp/archie-bundle.list -o Dir::Etc::SourceParts=-'
+           ' -o Dir::State::Lists=/tmp/archie-bundle-lists')
+else:
+    apt = 'apt-get'
+do(f'{apt} update') or sys.exit('Error: Unable to update Raspberry Pi OS.')
+do(f'{apt} -y dist-upgrade') or sys.exit('Error: Unable to dist-upgrade Raspberry Pi OS.')
+
+# Install all dependencies in a single transaction
+do(f'{apt} -y install {APT_PACKAGES}') or sys.exit('Error: cannot install dependencies')
+if args.bundle:
+    do(f'pip3 install --no-index --find-links {args.bundle}/wheels {PIP_PACKAGES} --break-system-packages') or sys.exit('Error: cannot install pip3 dependencies')
+else:
+    do(f'pip3 install {PIP_PACKAGES} --break-system-packages') or sys.exit('Error: cannot install pip3 dependencies')
+
+    # Set current data and time
+    do_live('ntpdate 0.pool.ntp.org')
 
 ###############################
 # Step 2: Setup wifi hotspot
 ###############################
 print('Setting up wifi hotspot...')
 
-# install hostapd
-do('apt-get -y install hostapd dnsmasq') or sys.exit('Unable to install hostapd.')
-do('systemctl stop hostapd') or sys.exit('Error: unable to stop hostapd.')
-do('systemctl stop dnsmasq') or sys.exit('Error: unable to stop dnsmasq.')
+# stop hostapd and dnsmasq until they are configured
+do_live('systemctl stop hostapd') or sys.exit('Error: unable to stop hostapd.')
+do_live('systemctl stop dnsmasq') or sys.exit('Error: unable to stop dnsmasq.')
 
 # update dhcpd.conf
-do('apt install dhcpcd -y') or sys.exit('Error: unable to install dhcpcd.')
 settings='interface wlan0\nstatic ip_address=10.10.10.10\nnohook wpa_supplicant\n'
 append_file('/etc/dhcpcd.conf', settings)
-do('systemctl restart dhcpcd') or sys.exit('Error: dhcpcd restart failed')
-
-# adjust settings in hostapd config file
-settings=f'interface=wlan0\ndriver=nl80211\nhw_mode=g\nchannel=4\nieee80211n=1\nwmm_enabled=0\nauth_algs=1\nssid={args.ssid}\nieee80211d=1\ncountry_code={args.country}\n'
-append_file('/etc/hostapd/hostapd.conf', settings) or sys.exit('Error: hostapd.conf append failed')
-replace_line('#DAEMON_CONF=""','DAEMON_CONF="/etc/hostapd/hostapd.conf"','/etc/default/hostapd') or sys.exit('Error: Line to replace not found in hostapd')
+do_live('systemctl restart dhcpcd') or sys.exit('Error: dhcpcd restart failed')
 
 #Create and edit a new dnsmasq configuration file to set IP address and DNS lease time
 do('mv /etc/dnsmasq.conf /etc/dnsmasq.conf.orig')
 settings='interface=wlan0\ndhcp-range=10.10.10.11,10.10.10.111,12h\n'
 append_file('/etc/dnsmasq.conf', settings) or sys.exit('Error adding lines to dnsmasq.conf file')
 
-# Add the country code to wpa_supplicant.conf in case it is needed
-append_file('/etc/wpa_supplicant/wpa_supplicant.conf',f'country={args.country}') or sys.exit('Error: adding wpa country code')
-
-# update regulatory domain configuration file
-# replace_line('REGDOMAIN=',f'REGDOMAIN={args.country}','/etc/default/crda') or sys.exit('Error: crda country update failed')
-do(f'iw reg set {args.country}') or sys.exit('Error: crda country update failed')
-
-# Disable Bluetooth and enable wifi
-# NOTE: wifi should only be enabled when country code is set properly (which it should be here)
-do('rfkill block bluetooth') or sys.exit('Error: bluetooth disable failed')
-do('rfkill unblock wifi') or sys.exit('Error: wifi enable failed')
+# Set the wifi country and radio profile (for an image, once the hardware is known at first boot)
+if args.image:
+    print('Wifi country, SSID and radio profile will be set at first boot (see archie-pi.txt).')
+else:
+    setup_wifi(args.country, args.ssid, args.band)
+replace_line('#DAEMON_CONF=""','DAEMON_CONF="/etc/hostapd/hostapd.conf"','/etc/default/hostapd') or sys.exit('Error: Line to replace not found in hostapd')
 
 # Unmask, enable and start open wifi access point
 do('systemctl unmask hostapd') or sys.exit('Error: unable to unmask hostapd')
 do('systemctl enable hostapd') or sys.exit('Error: unable to enable hostapd')
-do('systemctl start hostapd') or sys.exit('Error: unable to start hostapd')
-do('service dnsmasq start') or sys.exit('Error: service dnsmasq failed to start')
+do_live('systemctl start hostapd') or sys.exit('Error: unable to start hostapd')
+do_live('service dnsmasq start') or sys.exit('Error: service dnsmasq failed to start')
 
 ####################################################
 # Step 3: Setup web server and ARCHIE Pi index page
 ####################################################
 print('Setting up web server...')
-# Install nginx on Raspberry Pi:
-do('apt install nginx -y') or sys.exit('Unable to install nginx')
-
-# Install PHP and SQLite3:
-do('apt install php php-fpm php-cli -y') or sys.exit('Error: unable to install php')
-do('apt install php-sqlite3 -y') or sys.exit('Error: unable to install sqlite3')
-
 # Enable PHP in nginx config file
 conf_file = '/etc/nginx/sites-enabled/default'
 replace_line('root /var/www/html;','root /var/www;',conf_file) or sys.exit('Error: nginx config update failed')
@@ -187,6 +313,13 @@ uncomment_line('include snippets/fastcgi-php.conf', conf_file) or sys.exit('Erro
 uncomment_line('fastcgi_pass unix', conf_file) or sys.exit('Error: nginx config update failed')
 uncomment_line_after('fastcgi_pass 127.0.0.1',conf_file) or sys.exit('Error: nginx config update failed')
 
+# Set browser caching policy: module assets may be reused for a day before being revalidated
+# (cheaply, using ETags) while module pages and manifests are always revalidated
+settings = 'location ~* ^/modules/.+\\.(css|js|png|jpe?g|gif|svg|ico|woff2?|ttf)$ {\n\texpires 1d;\n}\n'
+settings += 'location ~* ^/modules/.+\\.(html?|json)$ {\n\tadd_header Cache-Control "no-cache";\n}'
+append_file('/etc/nginx/snippets/archie-cache.conf', settings) or sys.exit('Error: nginx cache config failed')
+replace_line('location / {', 'include snippets/archie-cache.conf;\n\n\tlocation / {', conf_file) or sys.exit('Error: nginx config update failed')
+
 # Install ARCHIE Pi web front page:
 print('Installing ARCHIE Pi web front end...')
 do('cp -r www/. /var/www/') or sys.exit('Error copying www files to /var/www')
@@ -194,20 +327,135 @@ do('mkdir /var/www/modules') or sys.exit('modules mkdir failed')
 do('chown -R www-data.www-data /var/www') or sys.exit('Error: unable tochange ownership of /var/www to www-data')
 
 # Restart nginx service
-do('service nginx restart') or sys.exit('Error: unable to restart nginx')
+do_live('service nginx restart') or sys.exit('Error: unable to restart nginx')
 
 ####################################################
 # Step 4: Setup Kiwix server 
 ####################################################
 print('Setting up kiwix server (requires a reboot to run)...')
-filename = get_latest_kiwix_tools('kiwix-tools_linux-armhf','https://download.kiwix.org/release/kiwix-tools/')
-print(f'Downloading {filename}...')
-do(f'wget -nv --show-progress -O {HOME}/kiwix-tools.tgz {filename}') or sys.exit('kiwix download failed')
+if args.bundle:
+    do(f'cp {args.bundle}/kiwix-tools.tgz {HOME}/kiwix-tools.tgz') or sys.exit('Error copying kiwix tools from bundle')
+else:
+    filename = get_latest_kiwix_tools()
+    print(f'Downloading {filename}...')
+    do(f'wget -nv --show-progress -O {HOME}/kiwix-tools.tgz {filename}') or sys.exit('kiwix download failed')
 do(f'mkdir {HOME}/kiwix')
 do(f'tar xzf {HOME}/kiwix-tools.tgz -C {HOME}/kiwix --strip-components=1')
 do(f'rm {HOME}/kiwix-tools.tgz')
 do(f'touch {HOME}/kiwix/library_zim.xml')
-replace_line('fi',f'fi\n\n{HOME}/kiwix/kiwix-serve --library --port 81 --blockexternal --nolibrarybutton --daemon {HOME}/kiwix/library_zim.xml', '/etc/rc.local') or sys.exit('rc.local line not updated')
+if args.fast_boot:
+    # start kiwix as soon as local filesystems are mounted rather than late from rc.local
+    # (kiwix-serve listens on all addresses so it need not wait for the network)
+    settings = f'[Unit]\nDescription=Kiwix server\nAfter=local-fs.target\n\n[Service]\nExecStart={HOME}/kiwix/kiwix-serve --library --port 81 --blockexternal --nolibrarybutton {HOME}/kiwix/library_zim.xml\nRestart=always\n\n[Install]\nWantedBy=multi-user.target'
+    append_file('/etc/systemd/system/kiwix-serve.service', settings) or sys.exit('Error: kiwix service install failed')
+    do('systemctl enable kiwix-serve') or sys.exit('Error: unable to enable kiwix service')
+else:
+    replace_line('fi',f'fi\n\n{HOME}/kiwix/kiwix-serve --library --port 81 --blockexternal --nolibrarybutton --daemon {HOME}/kiwix/library_zim.xml', '/etc/rc.local') or sys.exit('rc.local line not updated')
+
+#######################################################
+# Step 4a: Reduce the time from power-on to serving
+# Services start as soon as possible instead of waiting
+# for a network connection (normally there is none), and
+# services that are not needed are disabled. The boot
+# profiler records the boot-to-serving times of each boot.
+#######################################################
+print('Setting up boot profiler...')
+do('cp boot-profile.py /usr/local/sbin/archie-boot-profile.py') or sys.exit('Error copying boot profiler')
+label = 'fast-boot' if args.fast_boot else 'default'
+settings = f'[Unit]\nDescription=ARCHIE Pi boot profiler\nAfter=local-fs.target\n\n[Service]\nType=simple\nNice=10\nExecStart=/usr/bin/python3 /usr/local/sbin/archie-boot-profile.py record --remount --label {label}\n\n[Install]\nWantedBy=multi-user.target'
+append_file('/etc/systemd/system/archie-boot-profile.service', settings) or sys.exit('Error: boot profiler install failed')
+do('systemctl enable archie-boot-profile') or sys.exit('Error: unable to enable boot profiler')
+
+if args.fast_boot:
+    print('Reducing boot time...')
+    # nginx listens on all addresses, so start it without waiting for the network to be online
+    # (a copy of the unit in /etc replaces the packaged unit since dependencies cannot be removed by a drop-in)
+    try:
+        with open('/lib/systemd/system/nginx.service') as f:
+            unit = f.read()
+        with open('/etc/systemd/system/nginx.service', 'w') as f:
+            f.write(unit.replace('network-online.target', 'network.target'))
+    except:
+        sys.exit('Error: nginx service update failed')
+
+    # Do not wait for a DHCP lease on the (normally unplugged) ethernet port at boot
+    do('rm -f /etc/systemd/system/dhcpcd.service.d/wait.conf')
+
+    # Disable services and timers that are not needed by an offline access point
+    for unit in ['bluetooth.service', 'hciuart.service', 'triggerhappy.service', 'ModemManager.service',
+                 'NetworkManager-wait-online.service', 'systemd-networkd-wait-online.service',
+                 'apt-daily.timer', 'apt-daily-upgrade.timer', 'man-db.timer']:
+        do(f'systemctl disable {unit}')    # some units are not present on all OS versions
+    do_live('systemctl daemon-reload')
+
+####################################################
+# Step 4b: Setup content integrity scrubber
+# Each run verifies a slice of the installed modules with
+# idle priority and a limited I/O budget. Runs are timed
+# from boot as well as nightly since the clock may be wrong
+# without internet access.
+####################################################
+print('Setting up content integrity scrubber...')
+do('cp scrub-modules.py /usr/local/sbin/archie-scrub.py') or sys.exit('Error copying scrubber')
+settings = '[Unit]\nDescription=ARCHIE Pi content integrity scrubber\n\n[Service]\nType=oneshot\nNice=19\nIOSchedulingClass=idle\nExecStart=/usr/bin/python3 /usr/local/sbin/archie-scrub.py --remount scrub'
+append_file('/etc/systemd/system/archie-scrub.service', settings) or sys.exit('Error: scrubber service install failed')
+settings = '[Unit]\nDescription=Run the ARCHIE Pi content integrity scrubber\n\n[Timer]\nOnCalendar=*-*-* 02:00:00\nOnBootSec=1h\nOnUnitActiveSec=1d\n\n[Install]\nWantedBy=timers.target'
+append_file('/etc/systemd/system/archie-scrub.timer', settings) or sys.exit('Error: scrubber timer install failed')
+do('systemctl enable archie-scrub.timer') or sys.exit('Error: unable to enable scrubber timer')
+
+if args.cluster_node:
+    ####################################################
+    # Optional: Setup cluster mode
+    # Several ARCHIE Pis connected by a wired LAN act as one hotspot.
+    # The wifi and ethernet interfaces are bridged so all clients and
+    # nodes share one network (10.10.0.0/16) and each node serves its
+    # own range of DHCP addresses. The cluster service discovers the
+    # other nodes and shares content between them.
+    ####################################################
+    address = f'10.10.{args.cluster_node}.10'
+    print(f'Setting up cluster mode (node address {address})...')
+    append_file('/etc/systemd/network/bridge-br0.netdev', '[NetDev]\nName=br0\nKind=bridge') or sys.exit('Error: bridge setup failed')
+    append_file('/etc/systemd/network/br0-member-eth0.network', '[Match]\nName=eth0\n\n[Network]\nBridge=br0') or sys.exit('Error: bridge setup failed')
+    append_file('/etc/systemd/network/br0.network', f'[Match]\nName=br0\n\n[Network]\nAddress={address}/16') or sys.exit('Error: bridge setup failed')
+    prepend_file('/etc/dhcpcd.conf', 'denyinterfaces wlan0 eth0 br0') or sys.exit('Error: dhcpcd.conf update failed')
+    do('systemctl enable systemd-networkd') or sys.exit('Error: unable to enable systemd-networkd')
+    append_file('/etc/hostapd/hostapd.conf', 'bridge=br0') or sys.exit('Error: hostapd.conf append failed')
+    replace_line('interface=wlan0', 'interface=br0', '/etc/dnsmasq.conf') or sys.exit('Error: dnsmasq.conf update failed')
+    replace_line('dhcp-range=10.10.10.11,10.10.10.111,12h', f'dhcp-range=10.10.{args.cluster_node}.11,10.10.{args.cluster_node}.111,255.255.0.0,12h', '/etc/dnsmasq.conf') or sys.exit('Error: dnsmasq.conf update failed')
+
+    # Nodes only trust beacons and requests signed with the cluster secret, since students'
+    # devices share the bridged network
+    os.makedirs('/etc/archie-pi', exist_ok=True)
+    append_file('/etc/archie-pi/cluster.key', args.cluster_secret) or sys.exit('Error: unable to save cluster secret')
+    os.chmod('/etc/archie-pi/cluster.key', 0o600)
+
+    # Install and enable the cluster service
+    do('cp cluster.py /usr/local/sbin/archie-cluster.py') or sys.exit('Error copying cluster service')
+    settings = f'[Unit]\nDescription=ARCHIE Pi cluster service\nAfter=network.target\n\n[Service]\nExecStart=/usr/bin/python3 /usr/local/sbin/archie-cluster.py --remount --kiwix {HOME}/kiwix serve --address {address}\nRestart=always\n\n[Install]\nWantedBy=multi-user.target'
+    append_file('/etc/systemd/system/archie-cluster.service', settings) or sys.exit('Error: cluster service install failed')
+    do('systemctl enable archie-cluster') or sys.exit('Error: unable to enable cluster service')
+
+if args.image:
+    ####################################################
+    # Step 4c: Defer hardware settings to first boot
+    # An image is configured in a chroot on another machine, so the
+    # settings that depend on the wifi adapter of each Pi, and the keys
+    # that must be unique to each Pi, are applied by a service at first
+    # boot using the settings in archie-pi.txt on the boot partition.
+    ####################################################
+    print('Setting up first boot service...')
+    config_file = FIRST_BOOT_CONFIG[0] if os.path.isdir(os.path.dirname(FIRST_BOOT_CONFIG[0])) else FIRST_BOOT_CONFIG[1]
+    settings = '# ARCHIE Pi settings applied at first boot (this file can be edited on any computer after flashing)\n'
+    settings += f"country={args.country or ''}\nssid={args.ssid}\nband={args.band}\n"
+    settings += f'# add a line for each SSH public key allowed to log in as {user}, for example:\n# ssh_key=ssh-ed25519 AAAA... admin@example.org'
+    append_file(config_file, settings) or sys.exit('Error: unable to create first boot settings file')
+    setup = os.path.abspath(__file__)
+    settings = f'[Unit]\nDescription=ARCHIE Pi first boot settings\nConditionPathExists=!{FIRST_BOOT_DONE}\n'
+    settings += 'After=local-fs.target systemd-rfkill.service sys-subsystem-net-devices-wlan0.device\nWants=sys-subsystem-net-devices-wlan0.device\n'
+    settings += f'Before=hostapd.service dnsmasq.service ssh.service\n\n[Service]\nType=oneshot\nWorkingDirectory={os.path.dirname(setup)}\n'
+    settings += f'ExecStart=/usr/bin/python3 {setup} --first-boot --user {user}\n\n[Install]\nWantedBy=multi-user.target'
+    append_file('/etc/systemd/system/archie-first-boot.service', settings) or sys.exit('Error: first boot service install failed')
+    do('systemctl enable archie-first-boot') or sys.exit('Error: unable to enable first boot service')
 
 def read_only_filesystem():
     ###############################################################
@@ -221,8 +469,8 @@ def read_only_filesystem():
     # Disable swap to eliminate swap writes to SD card.
     # Note that this will limit running programs to the physcial memory space
     print('Disabling swap...')
-    do('dphys-swapfile swapoff') or sys.exit('Error: swapoff failed!')
-    do('dphys-swapfile uninstall') or sys.exit('Error: swap uninstall failed!')
+    do_live('dphys-swapfile swapoff') or sys.exit('Error: swapoff failed!')
+    do_live('dphys-swapfile uninstall') or sys.exit('Error: swap uninstall failed!')
     do('update-rc.d dphys-swapfile remove') or sys.exit('Error: swapfile remove failed!')
     do('apt -y purge dphys-swapfile') or sys.exit('Error: could not purge swapfile')
 
@@ -248,21 +496,24 @@ def read_only_filesystem():
     append_file('/etc/fstab','tmpfs   /var/lib/php/sessions tmpfs   nodev,noatime,nosuid,mode=0777,size=64k  0 0') or sys.exit('fstab append error')
 
     # nginx requires the log folder be present; create folder in the tmpfs at each startup
-    append_file('/var/spool/cron/crontabs/root','@reboot mkdir /var/log/nginx') or sys.exit('crontab append error')
-    do('chmod 600 /var/spool/cron/crontabs/root') or sys.exit('Error: chmod failed')
+    # (using tmpfiles.d so the folder exists before nginx starts, rather than a cron job which runs later)
+    append_file('/etc/tmpfiles.d/archie-pi.conf','d /var/log/nginx 0755 root adm -') or sys.exit('tmpfiles append error')
 
     # Move dhcp-leasefile to a tmpfs folder
     append_file('/etc/dnsmasq.conf','dhcp-leasefile=/var/log/dnsmasq.leases') or sys.exit('Error updating dhcp-leasefile location')
 
     # Move hwclock to a tmpfs folder
-    do('rm /etc/fake-hwclock.data') or sys.exit('Error removing existing hwclock file')
+    do('rm -f /etc/fake-hwclock.data') or sys.exit('Error removing existing hwclock file')
     do('ln -s /tmp/fake-hwclock.data /etc/fake-hwclock.data') or sys.exit('Error moving hwclock data file')
 
     # Move resolv.conf to a tmpfs folder
-    do('systemctl stop dhcpcd') or sys.exit('Error: dhcpcd stop failed')
+    do_live('systemctl stop dhcpcd') or sys.exit('Error: dhcpcd stop failed')
     do('rm /etc/resolv.conf')
     do('ln -s /tmp/resolv.conf /etc/resolv.conf') or sys.exit('Error creating link to resolv.conf')
-    do('systemctl start dhcpcd') or sys.exit('Error: dhcpcd start failed')
+    do_live('systemctl start dhcpcd') or sys.exit('Error: dhcpcd start failed')
+
+if args.read_only:
+    read_only_filesystem()
 
 ############################
 # Step 6: Clean up
@@ -270,8 +521,12 @@ def read_only_filesystem():
 do('apt autoremove -y')
 do('apt clean')
 
+if args.image:
+    print('\nThe ARCHIE Pi image has been configured successfully!')
+    sys.exit(0)
+
 print('\nThe ARCHIE Pi access point has installed successfully!')
 print('Note that this program cannot be rerun since it requires a fresh install of the OS.')
-print(f'Connect a computer to the wifi access point named {args.ssid} and point a browser to: http://10.10.10.10.')
+print(f"Connect a computer to the wifi access point named {args.ssid} and point a browser to: http://{address if args.cluster_node else '10.10.10.10'}.")
 print('Note that these new settings will require a reboot to take effect\nand you will need to install some content modules next.')
 print('Don\'t forget to change the default password for the user pi!')
@@ -0,0 +1,134 @@
+#!/usr/bin/python3
+# Simple iperf-style script to measure the wifi throughput of the
+# ARCHIE Pi (Another Remote Community Hotspot for Instruction and Education).
+# Run the script as a server on the ARCHIE Pi and as a client on a computer
+# connected to the ARCHIE Pi access point (only python3 is required).
+#
+# (C) 2026 faculty and students from Calvin University
+#
+# License: GNU General Public License (GPL) v3
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+
+import argparse
+import socket
+import sys
+import threading
+import time
+
+BLOCK_SIZE = 128*1024     # size of each block of data sent over the network
+
+# Helper functions
+def send_for(conn, duration):
+    ''' Send data over a connection for a given number of seconds and return the number of bytes sent
+    '''
+    block = bytes(BLOCK_SIZE)
+    total = 0
+    end = time.monotonic() + duration
+    while time.monotonic() < end:
+        conn.sendall(block)
+        total += len(block)
+    return total
+
+def receive_all(conn):
+    ''' Receive data from a connection until the sender stops and return the number of bytes received
+    '''
+    total = 0
+    while True:
+        data = conn.recv(BLOCK_SIZE)
+        if not data:
+            break
+        total += len(data)
+    return total
+
+def handle_client(conn, addr):
+    ''' Run a single test requested by a client. The client sends a one line request containing the
+        direction ("up" or "down") and the duration in seconds.
+    '''
+    with conn:
+        request = b''
+        while not request.endswith(b'\n'):
+            data = conn.recv(1)
+            if not data:
+                return
+            request += data
+        direction, duration = request.decode('utf-8').split()
+        print(f'{addr[0]}: testing {direction}load for {duration} seconds')
+        if direction == 'up':
+            start = time.monotonic()
+            total = receive_all(conn)
+            elapsed = time.monotonic() - start
+            conn.sendall(f'{total} {elapsed}\n'.encode('utf-8'))
+        else:
+            send_for(conn, float(duration))
+            conn.shutdown(socket.SHUT_WR)
+
+def server(port):
+    ''' Wait for clients and run the tests they request
+    '''
+    listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    listener.bind(('', port))
+    listener.listen()
+    print(f'Throughput test server listening on port {port} (press ctrl-c to quit)...')
+    try:
+        while True:
+            conn, addr = listener.accept()
+            threading.Thread(target=handle_client, args=(conn, addr), daemon=True).start()
+    except KeyboardInterrupt:
+        listener.close()
+
+def run_test(host, port, direction, duration):
+    ''' Run a test against a server and return the throughput in Mbit/s
+    '''
+    with socket.create_connection((host, port)) as conn:
+        conn.sendall(f'{direction} {duration}\n'.encode('utf-8'))
+        if direction == 'up':
+            send_for(conn, duration)
+            conn.shutdown(socket.SHUT_WR)
+            total, elapsed = conn.makefile().readline().split()
+            total, elapsed = int(total), float(elapsed)
+        else:
+            start = time.monotonic()
+            total = receive_all(conn)
+            elapsed = time.monotonic() - start
+    return total*8/elapsed/1e6
+
+def client(host, port, duration, streams):
+    ''' Measure the upload and download throughput using one or more parallel connections
+    '''
+    for direction in ['down','up']:
+        results = []
+        def worker():
+            results.append(run_test(host, port, direction, duration))
+        threads = [threading.Thread(target=worker) for i in range(streams)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if len(results) < streams:
+            sys.exit(f'Error: {direction}load test failed')
+        print(f'{direction.capitalize()}load: {sum(results):.1f} Mbit/s')
+
+parser = argparse.ArgumentParser(description='Measure network throughput to and from an ARCHIE Pi.')
+parser.add_argument("--server", dest="server", help="run as a server (on the ARCHIE Pi)",
+                    action='store_true')
+parser.add_argument("--client", dest="host", help="run as a client connecting to the given server address",
+                    type=str, required=False)
+parser.add_argument("--port", dest="port", help="TCP port used for the test (default 5201)",
+                    type=int, required=False, default=5201)
+parser.add_argument("--time", dest="time", help="duration of each test in seconds (default 10)",
+                    type=float, required=False, default=10)
+parser.add_argument("--parallel", dest="streams", help="number of parallel connections (default 1)",
+                    type=int, required=False, default=1)
+args = parser.parse_args()
+
+if args.server:
+    server(args.port)
+elif args.host:
+    print(f'Testing throughput to {args.host} for {args.time:g} seconds in each direction...')
+    client(args.host, args.port, args.time, args.streams)
+else:
+    parser.print_help()
@@ -18,18 +18,62 @@
 <p>Welcome to the <b>ARCHIE Pi</b>!</p>
 <?php
 // Show each installed module on the top level page (if any are installed)
-$files = scandir('/var/www/modules');
-if (count($files) == 2) {
+$modules = array();   // module name => address of the node serving it ('' for this node)
+foreach (scandir('/var/www/modules') as $file) {
+    if ($file[0] == '.') continue;   // skip hidden files (and partially synced modules)
+    $modules[$file] = '';
+}
+
+// In cluster mode, link each module to the least-loaded node holding it
+// (the state is ignored if cluster.py has not updated it for several polls, e.g. if it was stopped)
+$cluster = null;
+if (file_exists('/tmp/archie-cluster.json')) {
+    $cluster = json_decode(file_get_contents('/tmp/archie-cluster.json'), true);
+    if (!is_array($cluster) || !isset($cluster['updated']) || time() - $cluster['updated'] > 60) {
+        $cluster = null;
+    }
+}
+if ($cluster) {
+    $best = array();      // module name => load of the selected node
+    $remote = array();    // module name => title and ZIM name reported by the selected node
+    $nodes = $cluster['nodes'];
+    $self = array($cluster['self'] => $nodes[$cluster['self']]);
+    foreach ($self + $nodes as $id => $node) {   // this node first so it wins any tie
+        $load = array($node['load'], $node['loadavg']);
+        foreach ($node['modules'] as $name => $module) {
+            if (!isset($best[$name]) || $load < $best[$name]) {
+                $best[$name] = $load;
+                $modules[$name] = ($id == $cluster['self']) ? '' : $node['address'];
+                $remote[$name] = $module;
+            }
+        }
+    }
+    ksort($modules);
+}
+
+if (count($modules) == 0) {
     echo "<b>No modules currently installed.</b>";
  }
  else {
     echo "Installed modules are listed below:<br>";
-    foreach ($files as $file) {
-    if ($file == '.') continue;
-    if ($file == '..') continue;
-    $module = '/var/www/modules/'.$file.'/index.htmlf';
-    $dir = 'modules/'.$file;
-    include $module;
+    foreach ($modules as $file => $address) {
+    if ($address == '') {
+        $module = '/var/www/modules/'.$file.'/index.htmlf';
+        $dir = 'modules/'.$file;
+        include $module;
+    }
+    else if (filter_var($address, FILTER_VALIDATE_IP)) {
+        // module is served by another node, so link to it there
+        // (content received from other nodes is only shown as escaped text, never run)
+        $module = $remote[$file];
+        if ($module['zim'] != '') {
+            $url = 'http://'.$address.':81/'.rawurlencode($module['zim']);
+        }
+        else {
+            $url = 'http://'.$address.'/modules/'.rawurlencode($file).'/';
+        }
+        echo "<div class=\"indexmodule\">\n<h2><a href=\"".htmlspecialchars($url)."\">".htmlspecialchars($module['title'])."</a></h2>\n</div>";
+    }
     }
  }
 ?>